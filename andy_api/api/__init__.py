@@ -1,21 +1,32 @@
-"""Initialization of flask app.
+"""Initialization of quart app.
 
-This module serves the purpose of initializing the flask application.
+This module serves the purpose of initializing the quart application, an
+ASGI app with the same API as flask whose views are coroutines.
 
 """
 from pathlib import Path
-from flask import Flask
-from flask_cors import CORS
-from . import api_routes
-from .state_manager import SHELVE_DIRECTORY
+from quart import Quart
+from quart_cors import cors
+from . import api_routes, chess_logic
+from .state_manager import SHELVE_DIRECTORY, start_write_behind
+from .session_sweeper import start_sweeper
+from .logging import start_log_writer
 
 
 def create_app(test_config=None):
     # Create shelve directory
     Path(SHELVE_DIRECTORY).mkdir(parents=True, exist_ok=True)
+    # Periodically persist cached session state
+    start_write_behind()
+    # Periodically expire idle sessions and evict finished games
+    start_sweeper()
+    # Write logs in the background, off the request path
+    start_log_writer()
+    # Start the engines up front so requests only pay for the search
+    chess_logic.init_engine_pool()
     # create and configure the app
-    app = Flask(__name__, instance_relative_config=True)
-    CORS(app, resources={r"/*": {"origins": "*"}})
+    app = cors(Quart(__name__, instance_relative_config=True),
+               allow_origin="*")
     app.config.from_mapping(
         SECRET_KEY="dev",
     )
@@ -29,7 +40,7 @@ def create_app(test_config=None):
 
     # Display the routes available
     @app.route("/")
-    def health_check():
+    async def health_check():
         return "Successfully running api!"
 
     # Register the API blueprint
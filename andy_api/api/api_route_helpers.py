@@ -1,12 +1,25 @@
 """Helper functions for api_routes to use.
 
 """
+import asyncio
+import json
+import struct
+import traceback
 
-from .state_manager import get_fulfillment_params, get_game_state
+from . import speech_text_processing
+from .chess_logic import evaluate_position_async
+from .engine_pool import get_loop
 from .intent_processing import error_fulfillment, utils, possible_actions
 
 
 TTS_ERROR_AUDIO_FILENAME = "./static_audio/tts-error.wav"
+TTS_ERROR_AUDIO_TYPE = "audio/wav"
+# The content type of the turn route's length-prefixed response
+TURN_RESPONSE_MIMETYPE = "application/x-andy-turn"
+# The content type of the turn route's streamed response
+TURN_STREAM_MIMETYPE = "application/x-andy-turn-stream"
+# The content type of streamed audio (see stream_speech)
+AUDIO_STREAM_MIMETYPE = "application/x-andy-audio-stream"
 
 
 def get_help_response(help_type):
@@ -41,10 +54,80 @@ def get_static_error_audio():
     return data
 
 
-def get_response_error_return(session_id, board_str):
+def get_audio_format(audio_format, accept_mimetypes):
+    """Returns the name of the audio format a client asked for.
+
+    Args:
+        audio_format (str): the audio_format query param, which takes
+            precedence, or None.
+        accept_mimetypes: the request's Accept header.
+
+    Returns:
+        str: a key of speech_text_processing.AUDIO_FORMATS, the default
+            format if the client did not ask for a known one.
+
+    """
+    audio_formats = speech_text_processing.AUDIO_FORMATS
+    if audio_format:
+        if audio_format not in audio_formats:
+            raise Exception(f"unknown audio_format {audio_format}")
+        return audio_format
+    # The default format comes first, so it is chosen for */*
+    names_by_mimetype = {
+        audio_formats[name].mimetype: name
+        for name in [speech_text_processing.DEFAULT_AUDIO_FORMAT,
+                     *audio_formats]
+    }
+    best_match = accept_mimetypes.best_match(list(names_by_mimetype))
+    return names_by_mimetype.get(
+        best_match, speech_text_processing.DEFAULT_AUDIO_FORMAT)
+
+
+def get_upload_audio_type(mimetype):
+    """Returns the content type to store a client's uploaded audio with.
+
+    Args:
+        mimetype (str): the Content-Type of the upload, without parameters.
+
+    """
+    if mimetype.startswith("audio/"):
+        return mimetype
+    return speech_text_processing.FILE_TYPE
+
+
+async def synthesize_speech_async(text, audio_format):
+    """Converts text into audio, falling back to the static error audio.
+
+    Must be awaited on the app's event loop. Does not touch session state.
+
+    Args:
+        text (str): the text to transform into audio.
+        audio_format (str): the name of the format to return (see
+            speech_text_processing.AUDIO_FORMATS).
+
+    Returns:
+        tuple: the raw bytes of the audio, its content type, and the
+            text-to-speech error message, or None if it succeeded.
+
+    """
+    # pylint: disable=broad-except
+    try:
+        return (
+            await speech_text_processing.generate_audio_response_async(
+                text, audio_format),
+            speech_text_processing.AUDIO_FORMATS[audio_format].mimetype,
+            None
+        )
+    except Exception:
+        err_msg = f"Error with text-to-speech: {traceback.format_exc()}"
+        return get_static_error_audio(), TTS_ERROR_AUDIO_TYPE, err_msg
+
+
+def get_response_error_return(session_state, board_str):
     """Returns a generic error response.
 
     Args:
+        session_state: the SessionState of the request.
         board_str: FEN representation of board from client.
 
     Returns:
@@ -76,7 +159,128 @@ def get_response_error_return(session_id, board_str):
     return {
         "response_text": response_text,
         "fulfillment_info": fulfillment_info,
-        'fulfillment_params': get_fulfillment_params(session_id),
+        'fulfillment_params': session_state.get_fulfillment_params(),
         "board_str": board_str,
-        'game_state': get_game_state(session_id)
+        'game_state': session_state.get_game_state()
     }
+
+
+async def stream_batch_evaluations(fens, profile, limit):
+    """Evaluates positions on the engine pool, yielding each as it finishes.
+
+    Must be iterated on the app's event loop.
+
+    Args:
+        fens (list): the FEN strings to evaluate.
+        profile (DifficultyProfile): the profile whose engine options to use.
+        limit (chess.engine.Limit): the search limit, or None for the
+            profile's limits.
+
+    Yields:
+        str: one line of JSON per position, in the order they finish.
+
+        {
+            'index': int,
+            'fen': str,
+            'score': {'cp': int | None, 'mate': int | None},
+            'best_move': str | None,
+            'pv': list,
+            'error': str (only present if the evaluation failed)
+        }
+
+    """
+    finished = asyncio.Queue()
+    futures = {}
+    for index, fen in enumerate(fens):
+        future = asyncio.wrap_future(asyncio.run_coroutine_threadsafe(
+            evaluate_position_async(fen, profile, limit), get_loop()))
+        future.add_done_callback(finished.put_nowait)
+        futures[future] = (index, fen)
+    try:
+        for _ in range(len(futures)):
+            future = await finished.get()
+            index, fen = futures[future]
+            try:
+                result = {'index': index, 'fen': fen, **future.result()}
+            except Exception as e:
+                result = {'index': index, 'fen': fen, 'error': repr(e)}
+            yield json.dumps(result) + "\n"
+    finally:
+        # Stop evaluating if the client goes away
+        for future in futures:
+            future.cancel()
+
+
+def pack_turn_response(info, response_audio, andy_move_audio):
+    """Packs a turn's JSON and audio clips into one length-prefixed body.
+
+    Each part is preceded by its length in bytes, as a 4-byte big-endian
+    unsigned integer: the JSON (UTF-8), the audio of the response to the user,
+    then the audio of Andy's move. A part that is not present has length 0.
+
+    Args:
+        info (dict): the JSON part of the response.
+        response_audio (bytes): the audio of the response to the user.
+        andy_move_audio (bytes): the audio of Andy's move, or None.
+
+    Returns:
+        bytes: the packed response body.
+
+    """
+    parts = [json.dumps(info).encode("utf-8"),
+             response_audio, andy_move_audio or b""]
+    return b"".join(frame_part(part) for part in parts)
+
+
+def frame_part(part):
+    """Prefixes part of a response with its length, as a 4-byte big-endian
+    unsigned integer."""
+    return struct.pack(">I", len(part)) + part
+
+
+async def stream_speech(text, audio_format, log_speech):
+    """Converts text into audio, yielding each sentence as it is ready.
+
+    Falls back to the static error audio if the first sentence fails, and
+    ends the stream early if a later one does. Must be iterated on the app's
+    event loop.
+
+    Args:
+        text (str): the text to transform into audio.
+        audio_format (str): the name of the format to return (see
+            speech_text_processing.AUDIO_FORMATS).
+        log_speech (function): called on a worker thread with the joined
+            audio, its content type and the text-to-speech error message, or
+            None if it succeeded, once the stream is done.
+
+    Yields:
+        bytes: the audio file of each sentence as a length-prefixed part (see
+            frame_part), then an empty part to end the stream.
+
+    """
+    # pylint: disable=broad-except
+    clips = []
+    audio_type = speech_text_processing.AUDIO_FORMATS[audio_format].mimetype
+    err_msg = None
+    sentences = speech_text_processing.generate_audio_stream(
+        text, audio_format)
+    try:
+        async for clip in sentences:
+            clips.append(clip)
+            yield frame_part(clip)
+    except Exception:
+        err_msg = f"Error with text-to-speech: {traceback.format_exc()}"
+        if not clips:
+            clips.append(get_static_error_audio())
+            audio_format = "wav"
+            audio_type = TTS_ERROR_AUDIO_TYPE
+            yield frame_part(clips[0])
+    finally:
+        await sentences.aclose()
+        await asyncio.to_thread(
+            log_speech,
+            speech_text_processing.join_audio_clips(clips, audio_format),
+            audio_type,
+            err_msg
+        )
+    yield frame_part(b"")
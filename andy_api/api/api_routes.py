@@ -4,31 +4,155 @@ Attributes:
     bp: The blueprint that the __init__.py will use to handle routing.
 
 """
+import asyncio
+import json
+import os
 import traceback
-from api.state_manager import get_game_state, set_curr_log_id, get_fulfillment_params, set_fulfillment_params
-from datetime import datetime
-from threading import Thread
-from flask import (
-    Blueprint, request, jsonify
+from functools import partial
+from api.state_manager import (
+    SessionState, load_session, new_lock_owner, session_lock
 )
-
-from . import speech_text_processing, dialogflow_andy, determine_andy_move
-from .intent_processing import intent_processing
+from datetime import datetime
+import chess.engine
+from quart import Blueprint, Response, request, jsonify, g
+
+from . import dialogflow_andy, determine_andy_move
+from .chess_logic import BoardContext, DIFFICULTY_PROFILES
+from .move_cache import best_move_cache
+from .tablebase import get_tablebase_info
+from .intent_processing import intent_processing, best_move
+from .intent_processing.utils import RESPONSE_TYPES
 from .logging import (
     log_andy_response,
     log_error,
     log_user_request,
     log_andy_move,
     log_help_response,
+    get_dropped_log_count,
     ERROR_TYPES
 )
-from .api_route_helpers import get_response_error_return, get_static_error_audio, get_help_response
+from .api_route_helpers import (
+    get_response_error_return,
+    get_help_response,
+    frame_part,
+    get_audio_format,
+    get_upload_audio_type,
+    pack_turn_response,
+    stream_batch_evaluations,
+    stream_speech,
+    synthesize_speech_async,
+    AUDIO_STREAM_MIMETYPE,
+    TURN_RESPONSE_MIMETYPE,
+    TURN_STREAM_MIMETYPE
+)
 
 bp = Blueprint('api', __name__, url_prefix='/api')
 
+# The most positions accepted by one evaluate-batch request
+EVALUATE_BATCH_MAX_POSITIONS = int(
+    os.environ.get("EVALUATE_BATCH_MAX_POSITIONS", 1000))
+# The largest search limits accepted by evaluate-batch. Every position is
+# searched for at most EVALUATE_BATCH_MAX_TIME seconds, even if only a node
+# or depth limit is given.
+EVALUATE_BATCH_MAX_TIME = float(
+    os.environ.get("EVALUATE_BATCH_MAX_TIME", 10))
+EVALUATE_BATCH_MAX_NODES = int(
+    os.environ.get("EVALUATE_BATCH_MAX_NODES", 10000000))
+EVALUATE_BATCH_MAX_DEPTH = int(
+    os.environ.get("EVALUATE_BATCH_MAX_DEPTH", 30))
+
+# Intents after which the client asks for Andy's move
+SPECULATIVE_MOVE_INTENTS = [
+    RESPONSE_TYPES.MOVE_PIECE.name,
+    RESPONSE_TYPES.CASTLE.name
+]
+
+
+def acquire_session(lock):
+    """Takes a session's lock and loads the session, waiting on this thread."""
+    lock.acquire()
+    try:
+        load_session(lock.session_id)
+    except Exception:
+        lock.release()
+        raise
+
+
+def release_abandoned_session(lock, acquiring):
+    """Releases a lock that was granted after its request went away."""
+    if not acquiring.cancelled() and acquiring.exception() is None:
+        release_sent_session(lock, acquiring)
+
+
+def release_sent_session(lock, task):
+    """Releases a session's lock on a worker thread once a task is done."""
+    asyncio.ensure_future(asyncio.to_thread(lock.release))
+
+
+@bp.before_request
+async def lock_session():
+    """Serializes requests for the same session in the order they arrive.
+
+    The request owns the lock rather than the event loop's thread, which it
+    shares with every other request. Waiting for the lock and reading the
+    session happen on a worker thread, so the event loop is never blocked.
+
+    """
+    session_id = request.args.get('session_id')
+    if session_id:
+        new_lock_owner()
+        lock = session_lock(session_id)
+        acquiring = asyncio.ensure_future(
+            asyncio.to_thread(acquire_session, lock))
+        try:
+            await asyncio.shield(acquiring)
+        except asyncio.CancelledError:
+            acquiring.add_done_callback(
+                partial(release_abandoned_session, lock))
+            raise
+        g.session_lock = lock
+
+
+@bp.teardown_request
+async def unlock_session(exc):
+    """Releases the session's lock once the request is done.
+
+    The session's changes are written to disk by state_manager (see
+    SessionLock.release). Streamed responses keep the lock until they are
+    sent instead (see stream_response).
+
+    """
+    lock = g.pop('session_lock', None)
+    if lock:
+        await asyncio.to_thread(lock.release)
+
+
+def stream_response(body, mimetype):
+    """Returns a response that streams an async generator.
+
+    The request's session lock is released once the body has been sent, or
+    the client has gone away, rather than when the view returns: the view's
+    task only finishes after its body has been sent. The body is sent with
+    a copy of the view's context, so it can take the request's lock again.
+    Streams have no time limit, since they take as long as the audio or
+    analysis they send.
+
+    Args:
+        body: the async generator of the response's parts.
+        mimetype (str): the content type of the response.
+
+    """
+    lock = g.pop('session_lock', None)
+    if lock:
+        asyncio.current_task().add_done_callback(
+            partial(release_sent_session, lock))
+    response = Response(body, mimetype=mimetype)
+    response.timeout = None
+    return response
+
 
 @bp.route("/get-help-audio-response", methods=["GET"])
-def get_help_audio_response():
+async def get_help_audio_response():
     """Route for getting help when a user might be confused.
 
     Likely called in the event of hitting FALLBACK too many times, or not
@@ -37,11 +161,15 @@ def get_help_audio_response():
     Query Params:
         session_id: the unique session ID to use with Andy.
         help_type: one of "FALLBACK" or "TIMEOUT"
+        stream: "true" to stream the audio a sentence at a time (optional).
+        audio_format: one of "wav", "mp3" or "ogg_opus" (optional). The
+            Accept header is used if not given, and "wav" if neither is.
 
     Returns:
         An HTTP response, with the data field containing the raw bytes of the
         audio file. The data field will only be present if the status code of
-        the response is 200.
+        the response is 200. If streamed, the audio of each sentence is sent
+        as it is ready (see api_route_helpers.stream_speech).
 
     """
     if request.method == "GET":
@@ -63,52 +191,95 @@ def get_help_audio_response():
         text_response = get_help_response(help_type)
 
         # Get the audio response
-        try:
-            response_audio = speech_text_processing.generate_audio_response(
-                text_response)
-        except Exception:
-            err_msg = f"Error with text-to-speech: {traceback.format_exc()}"
-            log_error(session_id, ERROR_TYPES.TTS, err_msg)
-            # Get the error response
-            err_response = get_static_error_audio()
-            # Log the request
-            response_at = datetime.now()
-            Thread(target=log_help_response(
-                session_id,
-                data={
-                    "help_type": help_type,
-                    "text": text_response,
-                    "audio_data": err_response,
-                    "received_at": received_at,
-                    "response_at": response_at
-                }
-            )).start()
-            # Return the error response
-            return err_response
-
-        # Log the request
-        response_at = datetime.now()
-        Thread(target=log_help_response(
-            session_id,
-            data={
-                "help_type": help_type,
-                "text": text_response,
-                "audio_data": response_audio,
-                "received_at": received_at,
-                "response_at": response_at
-            }
-        )).start()
+        audio_format = get_audio_format(
+            request.args.get('audio_format'), request.accept_mimetypes)
+        log_speech = partial(
+            log_help_audio, session_id, help_type, text_response,
+            received_at=received_at)
+        if request.args.get('stream') == "true":
+            return stream_response(
+                stream_speech(text_response, audio_format, log_speech),
+                AUDIO_STREAM_MIMETYPE
+            )
+        response_audio, audio_type, err_msg = await synthesize_speech_async(
+            text_response, audio_format)
+        await asyncio.to_thread(
+            log_speech, response_audio, audio_type, err_msg)
+
+        return Response(response_audio, mimetype=audio_type)
+
+
+def log_help_audio(session_id, help_type, text, response_audio, audio_type,
+                   err_msg, received_at):
+    """Queues a spoken help response, and any TTS error, to be logged.
+
+    Takes the session's lock, so it must not be called on the event loop.
+
+    Args:
+        session_id: the unique session ID to use with Andy.
+        help_type: one of "FALLBACK" or "TIMEOUT"
+        text (str): the text that was spoken.
+        response_audio (bytes): the audio returned to the client.
+        audio_type (str): the content type of the audio.
+        err_msg (str): the text-to-speech error, or None if it succeeded.
+        received_at (datetime): when the request was received.
+
+    """
+    if err_msg:
+        log_error(session_id, ERROR_TYPES.TTS, err_msg)
+    response_at = datetime.now()
+    log_help_response(
+        session_id,
+        data={
+            "help_type": help_type,
+            "text": text,
+            "audio_data": response_audio,
+            "audio_type": audio_type,
+            "received_at": received_at,
+            "response_at": response_at
+        }
+    )
+
+
+def log_spoken_response(session_id, text, response_audio, audio_type,
+                        err_msg, received_at):
+    """Queues one of Andy's spoken responses, and any TTS error, to be logged.
+
+    Takes the session's lock, so it must not be called on the event loop.
 
-        # Return
-        return response_audio
+    Args:
+        session_id: the unique session ID to use with Andy.
+        text (str): the text that was spoken.
+        response_audio (bytes): the audio returned to the client.
+        audio_type (str): the content type of the audio.
+        err_msg (str): the text-to-speech error, or None if it succeeded.
+        received_at (datetime): when the request was received.
+
+    """
+    if err_msg:
+        log_error(session_id, ERROR_TYPES.TTS, err_msg)
+    response_at = datetime.now()
+    log_andy_response(
+        session_id,
+        data={
+            "text": text,
+            "audio_data": response_audio,
+            "audio_type": audio_type,
+            "received_at": received_at,
+            "response_at": response_at
+        }
+    )
 
 
 @bp.route("/get-audio-response", methods=["POST"])
-def get_audio_response():
+async def get_audio_response():
     """Route for getting audio data from text.
 
     Query Params:
         session_id: the unique session ID to use with Andy.
+        stream: "true" to stream the audio a sentence at a time (optional).
+        audio_format: one of "wav", "mp3" or "ogg_opus" (optional). The
+            Accept header is used if not given, and "wav" if neither is.
 
     Body:
         Text that should be converted into audio.
@@ -116,10 +287,10 @@ def get_audio_response():
     Returns:
         An HTTP response, with the data field containing the raw bytes of the
         audio file. The data field will only be present if the status code of
-        the response is 200.
+        the response is 200. If streamed, the audio of each sentence is sent
+        as it is ready (see api_route_helpers.stream_speech).
 
     """
-    # pylint: disable=broad-except
     if request.method == "POST":
         received_at = datetime.now()
         session_id = request.args.get('session_id')
@@ -129,45 +300,76 @@ def get_audio_response():
             raise Exception("get-audio-response: missing session_id")
 
         # Convert response to audio
-        try:
-            response_audio = speech_text_processing.generate_audio_response(
-                request.data)
-        except Exception:
-            err_msg = f"Error with text-to-speech: {traceback.format_exc()}"
-            log_error(session_id, ERROR_TYPES.TTS, err_msg)
-            # Get the error response
-            err_response = get_static_error_audio()
-            # Log the request
-            response_at = datetime.now()
-            Thread(target=log_andy_response(
-                session_id,
-                data={
-                    "text": request.data.decode("utf-8"),
-                    "audio_data": err_response,
-                    "received_at": received_at,
-                    "response_at": response_at
-                }
-            )).start()
-            # Return the error response
-            return err_response
-
-        # Log the request
-        response_at = datetime.now()
-        Thread(target=log_andy_response(
-            session_id,
-            data={
-                "text": request.data.decode("utf-8"),
-                "audio_data": response_audio,
-                "received_at": received_at,
-                "response_at": response_at
-            }
-        )).start()
+        text = (await request.get_data()).decode("utf-8")
+        audio_format = get_audio_format(
+            request.args.get('audio_format'), request.accept_mimetypes)
+        log_speech = partial(
+            log_spoken_response, session_id, text, received_at=received_at)
+        if request.args.get('stream') == "true":
+            return stream_response(
+                stream_speech(text, audio_format, log_speech),
+                AUDIO_STREAM_MIMETYPE
+            )
+        response_audio, audio_type, err_msg = await synthesize_speech_async(
+            text, audio_format)
+        await asyncio.to_thread(
+            log_speech, response_audio, audio_type, err_msg)
+
+        return Response(response_audio, mimetype=audio_type)
 
-        return response_audio
+
+async def make_andy_move(session_id, board_str, received_at):
+    """Determines and plays Andy's move, and queues it to be logged.
+
+    Args:
+        session_id: the unique session ID to use with Andy.
+        board_str: the state of the chess board, as text.
+        received_at (datetime): when the request was received.
+
+    Returns:
+        dict: Andy's move (see get_andy_move_response).
+
+    """
+    # Determine Andy's response
+    session_state = SessionState(session_id)
+    response_text, updated_board_str, move_info = await determine_andy_move.determine_andy_move(
+        session_state,
+        BoardContext(board_str)
+    )
+    session_state.commit()
+
+    # Ponder Andy's replies to the user's likely moves, and analyse the
+    # user's best move in case they ask for a hint. Pondering is started
+    # first so it gets a background search slot first.
+    if not session_state.get_game_state()["game_finished"]:
+        determine_andy_move.start_pondering(
+            session_state, updated_board_str)
+        best_move.start_best_move_hint(session_id, updated_board_str)
+
+    # Queue Andy's move to be logged
+    response_at = datetime.now()
+    await asyncio.to_thread(
+        log_andy_move,
+        session_id,
+        data={
+            'move_info': move_info,
+            'board_str_before': board_str,
+            'board_str_after': updated_board_str,
+            'received_at': received_at,
+            'response_at': response_at
+        }
+    )
+
+    return {
+        'response_text': response_text,
+        'board_str': updated_board_str,
+        'move_info': move_info,
+        'game_state': session_state.get_game_state()
+    }
 
 
 @bp.route("/get-andy-move-response", methods=["GET"])
-def get_andy_move_response():
+async def get_andy_move_response():
     """Route for getting Andy's verbal move.
 
     Query Params:
@@ -202,35 +404,291 @@ def get_andy_move_response():
             raise Exception(
                 "get-audio-response: missing session_id or board_str")
 
-        # Determine Andy's response
-        response_text, updated_board_str, move_info = determine_andy_move.determine_andy_move(
-            session_id,
-            board_str
+        return jsonify(
+            await make_andy_move(session_id, board_str, received_at))
+
+
+@bp.route("/evaluate-batch", methods=["POST"])
+async def evaluate_batch():
+    """Route for evaluating many positions at once, for offline analysis.
+
+    Positions are searched in the background on the engine pool, with the
+    engine options Andy plays with at the given difficulty.
+
+    Body:
+        A JSON object.
+
+        {
+            'fens': list,
+            'difficulty': str,
+            'limit': {
+                'time': float,
+                'nodes': int,
+                'depth': int
+            }
+        }
+
+        fens (list): the FEN strings to evaluate.
+        difficulty (str): the difficulty profile to use ("hard" by default).
+        limit (dict): optional search limits, replacing the profile's limits
+            (see get_batch_limit).
+
+    Returns:
+        An HTTP response streaming newline-delimited JSON, with one line per
+        position in the order they finish (see
+        api_route_helpers.stream_batch_evaluations).
+
+    """
+    if request.method == "POST":
+        body = await request.get_json() or {}
+        fens = body.get('fens')
+        difficulty = body.get('difficulty', "hard")
+        limit = body.get('limit')
+
+        # Make sure the body is valid
+        if not isinstance(fens, list) or not fens:
+            raise Exception("evaluate-batch: missing fens")
+        if len(fens) > EVALUATE_BATCH_MAX_POSITIONS:
+            raise Exception(
+                f"evaluate-batch: more than {EVALUATE_BATCH_MAX_POSITIONS} fens")
+        if difficulty not in DIFFICULTY_PROFILES:
+            raise Exception(
+                f"evaluate-batch: unknown difficulty {difficulty}")
+
+        if limit is not None:
+            limit = get_batch_limit(limit)
+
+        return stream_response(
+            stream_batch_evaluations(
+                fens, DIFFICULTY_PROFILES[difficulty], limit),
+            "application/x-ndjson"
         )
 
-        # Log Andy's move on a separate thread
+
+def get_batch_limit(limit):
+    """Returns the engine limit for the limit field of an evaluate-batch body.
+
+    Each limit is capped by EVALUATE_BATCH_MAX_TIME, EVALUATE_BATCH_MAX_NODES
+    or EVALUATE_BATCH_MAX_DEPTH, and the time limit defaults to
+    EVALUATE_BATCH_MAX_TIME so no search is unbounded.
+
+    Args:
+        limit (dict): any of 'time' (seconds), 'nodes' and 'depth'.
+
+    Raises:
+        Exception: if the limit has unknown keys or values that are not
+            positive numbers, or sets none of time, nodes and depth.
+
+    """
+    caps = {
+        'time': EVALUATE_BATCH_MAX_TIME,
+        'nodes': EVALUATE_BATCH_MAX_NODES,
+        'depth': EVALUATE_BATCH_MAX_DEPTH
+    }
+    if not isinstance(limit, dict):
+        raise Exception("evaluate-batch: limit is not an object")
+    unknown = set(limit) - set(caps)
+    if unknown:
+        raise Exception(
+            f"evaluate-batch: unknown limits {', '.join(sorted(unknown))}")
+
+    values = {}
+    for key, value in limit.items():
+        if value is None:
+            continue
+        # Nodes and depth are whole numbers, time may be fractional
+        types = (int, float) if key == 'time' else int
+        if isinstance(value, bool) or not isinstance(value, types) or not value > 0:
+            raise Exception(
+                f"evaluate-batch: limit {key} is not a positive number")
+        values[key] = min(value, caps[key])
+    if not values:
+        raise Exception("evaluate-batch: limit sets no time, nodes or depth")
+
+    return chess.engine.Limit(
+        time=values.get('time', EVALUATE_BATCH_MAX_TIME),
+        nodes=values.get('nodes'),
+        depth=values.get('depth')
+    )
+
+
+@bp.route("/engine-stats", methods=["GET"])
+async def engine_stats():
+    """Route for getting the hit counters of the engine's shortcuts.
+
+    Also reports how many logs have been dropped (see logging).
+
+    Returns:
+        An HTTP response, with the data field containing a JSON object.
+
+        {
+            'best_move_cache': {
+                'hits': int,
+                'misses': int,
+                'size': int,
+                'max_size': int
+            },
+            'tablebase': {
+                'hits': int,
+                'misses': int,
+                'hit_rate': float,
+                'max_pieces': int
+            },
+            'dropped_logs': int
+        }
+
+    """
+    return jsonify({
+        'best_move_cache': best_move_cache.info(),
+        'tablebase': get_tablebase_info(),
+        'dropped_logs': get_dropped_log_count()
+    })
+
+
+async def respond_to_user(session_id, detected_text, board_str, audio_data,
+                          audio_type, recording_time_ms, received_at):
+    """Detects and fulfills the user's intent, and queues it to be logged.
+
+    Fulfillment may wait on the engine, so it runs on a worker thread.
+
+    Args:
+        session_id: the unique session ID to use with Andy.
+        detected_text: the text detected from the user.
+        board_str: FEN representation of board from client.
+        audio_data: the audio the user's text was detected from.
+        audio_type (str): the content type of audio_data.
+        recording_time_ms: how long the client took to record, in ms.
+        received_at (datetime): when the request was received.
+
+    Returns:
+        dict: the response for the user (see get_response).
+
+    """
+    # pylint: disable=broad-except
+    # Load the session state once for the whole request
+    session_state = SessionState(session_id)
+    if session_state.get_game_state()["game_started"] and not board_str:
+        raise Exception("the game has started and board_str is missing")
+
+    # Reset the current log id
+    session_state.set_curr_log_id(None)
+    # Reset the fulfillment_params
+    session_state.set_fulfillment_params(None)
+    session_state.commit()
+
+    # Detect intent from text
+    intent_query_response = None
+    try:
+        intent_query_response = await dialogflow_andy.perform_intent_query_async(
+            session_id, detected_text)
+    except Exception:
+        # Log the error
+        err_msg = f"Error performing intent detection: {traceback.format_exc()}"
+        await asyncio.to_thread(
+            log_error, session_id, ERROR_TYPES.INTENT, err_msg)
+        # Get the error response
+        err_response = get_response_error_return(session_state, board_str)
+        # Queue the user request to be logged
+        response_at = datetime.now()
+        await asyncio.to_thread(
+            log_user_request,
+            session_id,
+            data={
+                "text": detected_text,
+                "audio_data": audio_data,
+                "audio_type": audio_type,
+                "detected_intent": None,
+                "detected_fulfillment": err_response["fulfillment_info"]["intent_name"],
+                "fulfillment_success": err_response["fulfillment_info"]["success"],
+                "board_str_before": board_str,
+                "board_str_after": board_str,
+                "received_at": received_at,
+                "response_at": response_at,
+                "recording_time_ms": float(recording_time_ms)
+            }
+        )
+        # Send the error response
+        return err_response
+    # Determine Andy's response
+    try:
+        response_text, fulfillment_info, updated_board_str = await asyncio.to_thread(
+            intent_processing.fulfill_intent,
+            session_state=session_state,
+            board_str=board_str,
+            intent_data=intent_query_response
+        )
+    except Exception:
+        # Discard any partial changes made during fulfillment
+        session_state.rollback()
+        # Log the error
+        err_msg = f"Error performing fulfillment: {traceback.format_exc()}"
+        await asyncio.to_thread(
+            log_error, session_id, ERROR_TYPES.FULFILLMENT, err_msg)
+        # Get the error response
+        err_response = get_response_error_return(session_state, board_str)
+        # Queue the user request to be logged
         response_at = datetime.now()
-        Thread(target=log_andy_move(
+        await asyncio.to_thread(
+            log_user_request,
             session_id,
             data={
-                'move_info': move_info,
-                'board_str_before': board_str,
-                'board_str_after': updated_board_str,
-                'received_at': received_at,
-                'response_at': response_at
+                "text": detected_text,
+                "audio_data": audio_data,
+                "audio_type": audio_type,
+                "detected_intent": intent_query_response.intent.name if intent_query_response is not None else None,
+                "detected_fulfillment": err_response["fulfillment_info"]["intent_name"],
+                "fulfillment_success": err_response["fulfillment_info"]["success"],
+                "board_str_before": board_str,
+                "board_str_after": board_str,
+                "received_at": received_at,
+                "response_at": response_at,
+                "recording_time_ms": float(recording_time_ms)
             }
-        )).start()
+        )
+        # Send the error response
+        return err_response
+
+    # Apply the changes made during fulfillment
+    session_state.commit()
+
+    # Start on Andy's reply while the client plays the acknowledgement
+    if (fulfillment_info["success"]
+            and fulfillment_info["intent_name"] in SPECULATIVE_MOVE_INTENTS
+            and not session_state.get_game_state()["game_finished"]):
+        determine_andy_move.start_speculative_move(
+            session_state, updated_board_str)
+
+    # Queue the user request to be logged
+    response_at = datetime.now()
+    await asyncio.to_thread(
+        log_user_request,
+        session_id,
+        data={
+            "text": detected_text,
+            "audio_data": audio_data,
+            "audio_type": audio_type,
+            "detected_intent": intent_query_response.intent.name if intent_query_response is not None else None,
+            "detected_fulfillment": fulfillment_info["intent_name"],
+            "fulfillment_success": fulfillment_info["success"],
+            "board_str_before": board_str,
+            "board_str_after": updated_board_str,
+            "received_at": received_at,
+            "response_at": response_at,
+            "recording_time_ms": float(recording_time_ms)
+        }
+    )
 
-        return jsonify({
-            'response_text': response_text,
-            'board_str': updated_board_str,
-            'move_info': move_info,
-            'game_state': get_game_state(session_id)
-        })
+    return {
+        'response_text': response_text,
+        'fulfillment_info': fulfillment_info,
+        'fulfillment_params': session_state.get_fulfillment_params(),
+        'board_str': updated_board_str,
+        'game_state': session_state.get_game_state()
+    }
 
 
 @bp.route("/get-response", methods=["POST"])
-def get_response():
+async def get_response():
     """Route for getting a response from Andy and any actions to take.
 
     Query Params:
@@ -240,7 +698,8 @@ def get_response():
         recording_time_ms: how long the client took to record, in ms.
 
     Body:
-        A Blob that contains the audio to interpret.
+        A Blob that contains the audio to interpret, with its Content-Type,
+        such as "audio/flac" or "audio/wav" (the default).
 
     Returns:
         An HTTP response, with the data field containing a JSON object. The data
@@ -288,101 +747,199 @@ def get_response():
         board_str = request.args.get('board_str')
 
         # Make sure query params are present
-        game_state = get_game_state(session_id)
-        if not session_id or not detected_text or (game_state["game_started"] and not board_str):
+        if not session_id or not detected_text:
             raise Exception(
-                "get-response: missing session_id , detected_text, or the game has started and board_str is missing")
+                "get-response: missing session_id or detected_text")
 
-        # Reset the current log id
-        set_curr_log_id(session_id, None)
-        # Reset the fulfillment_params
-        set_fulfillment_params(session_id, None)
+        return jsonify(await respond_to_user(
+            session_id,
+            detected_text,
+            board_str,
+            await request.get_data(),
+            get_upload_audio_type(request.mimetype),
+            recording_time_ms,
+            received_at
+        ))
+
+
+def andy_moves_next(user_response):
+    """Returns whether Andy should move after the response to the user."""
+    fulfillment_info = user_response["fulfillment_info"]
+    game_state = user_response["game_state"]
+    if not fulfillment_info["success"] or game_state["game_finished"]:
+        return False
+    intent_name = fulfillment_info["intent_name"]
+    return intent_name in SPECULATIVE_MOVE_INTENTS or (
+        intent_name == RESPONSE_TYPES.SELECT_DIFFICULTY.name
+        and game_state["chosen_side"] == "black")
+
+
+async def stream_turn(session_id, user_response, audio_format, received_at):
+    """Yields a whole turn, sending the response's audio as it is ready.
+
+    Andy's move is determined once the first sentence of the response has
+    been sent, so the client plays it in the meantime.
+
+    Args:
+        session_id: the unique session ID to use with Andy.
+        user_response (dict): the response for the user (see
+            respond_to_user).
+        audio_format (str): the name of the format to speak in (see
+            speech_text_processing.AUDIO_FORMATS).
+        received_at (datetime): when the request was received.
 
-        # Detect intent from text
-        intent_query_response = None
-        try:
-            intent_query_response = dialogflow_andy.perform_intent_query(
-                session_id, detected_text)
-        except Exception:
-            # Log the error
-            err_msg = f"Error performing intent detection: {traceback.format_exc()}"
-            log_error(session_id, ERROR_TYPES.INTENT, err_msg)
-            # Get the error response
-            err_response = get_response_error_return(session_id, board_str)
-            # Log the user request on a separate thread
-            response_at = datetime.now()
-            Thread(target=log_user_request(
-                session_id,
-                data={
-                    "text": detected_text,
-                    "audio_data": request.data,
-                    "detected_intent": None,
-                    "detected_fulfillment": err_response["fulfillment_info"]["intent_name"],
-                    "fulfillment_success": err_response["fulfillment_info"]["success"],
-                    "board_str_before": board_str,
-                    "board_str_after": board_str,
-                    "received_at": received_at,
-                    "response_at": response_at,
-                    "recording_time_ms": float(recording_time_ms)
-                }
-            )).start()
-            # Send the error response
-            return jsonify(err_response)
-        # Determine Andy's response
-        try:
-            response_text, fulfillment_info, updated_board_str = intent_processing.fulfill_intent(
-                session_id=session_id,
-                board_str=board_str,
-                intent_data=intent_query_response
-            )
-        except Exception:
-            # Log the error
-            err_msg = f"Error performing fulfillment: {traceback.format_exc()}"
-            log_error(session_id, ERROR_TYPES.FULFILLMENT, err_msg)
-            # Get the error response
-            err_response = get_response_error_return(session_id, board_str)
-            # Log the user request on a separate thread
-            response_at = datetime.now()
-            Thread(target=log_user_request(
-                session_id,
-                data={
-                    "text": detected_text,
-                    "audio_data": request.data,
-                    "detected_intent": intent_query_response.intent.name if intent_query_response is not None else None,
-                    "detected_fulfillment": err_response["fulfillment_info"]["intent_name"],
-                    "fulfillment_success": err_response["fulfillment_info"]["success"],
-                    "board_str_before": board_str,
-                    "board_str_after": board_str,
-                    "received_at": received_at,
-                    "response_at": response_at,
-                    "recording_time_ms": float(recording_time_ms)
-                }
-            )).start()
-            # Send the error response
-            return jsonify(err_response)
-
-        # Log the user request on a separate thread
-        response_at = datetime.now()
-        Thread(target=log_user_request(
+    Yields:
+        bytes: the length-prefixed parts of the turn (see turn).
+
+    """
+    yield frame_part(json.dumps(user_response).encode("utf-8"))
+    response_speech = stream_speech(
+        user_response["response_text"],
+        audio_format,
+        partial(log_spoken_response, session_id,
+                user_response["response_text"], received_at=received_at)
+    )
+    try:
+        yield await response_speech.__anext__()
+
+        andy_move = None
+        if andy_moves_next(user_response):
+            andy_move = await make_andy_move(
+                session_id, user_response["board_str"], received_at)
+        async for part in response_speech:
+            yield part
+    finally:
+        # Log the response here, not whenever an abandoned stream is collected
+        await response_speech.aclose()
+
+    yield frame_part(json.dumps(andy_move).encode("utf-8"))
+    if andy_move is None:
+        yield frame_part(b"")
+        return
+    andy_move_speech = stream_speech(
+        andy_move["response_text"],
+        audio_format,
+        partial(log_spoken_response, session_id,
+                andy_move["response_text"], received_at=received_at)
+    )
+    try:
+        async for part in andy_move_speech:
+            yield part
+    finally:
+        await andy_move_speech.aclose()
+
+
+@bp.route("/turn", methods=["POST"])
+async def turn():
+    """Route for a whole turn in one round trip.
+
+    Combines get-response, get-audio-response for its response, and
+    get-andy-move-response and get-audio-response for Andy's move, if Andy
+    moves next. The response to the user is spoken while Andy's move is
+    determined, and Andy's move is spoken at the same time.
+
+    Query Params:
+        session_id: the unique session ID to use with Andy.
+        board_str: FEN representation of board from client.
+        detected_text: the text detected from the user.
+        recording_time_ms: how long the client took to record, in ms.
+        stream: "true" to stream the audio a sentence at a time (optional).
+        audio_format: one of "wav", "mp3" or "ogg_opus" (optional). The
+            Accept header is used if not given, and "wav" if neither is.
+
+    Body:
+        A Blob that contains the audio to interpret, with its Content-Type,
+        such as "audio/flac" or "audio/wav" (the default).
+
+    Returns:
+        An HTTP response, with the data field containing three length-prefixed
+        parts (see api_route_helpers.pack_turn_response): a JSON object, the
+        audio of the response to the user and the audio of Andy's move. The
+        data field will only be present if the status code of the response is
+        200.
+
+        If streamed, the parts are instead: the JSON object without
+        andy_move, the streamed audio of the response to the user (see
+        api_route_helpers.stream_speech), andy_move as JSON, then the
+        streamed audio of Andy's move (only an empty part if andy_move is
+        null).
+
+        {
+            'response_text': str,
+            'fulfillment_info': dict,
+            'fulfillment_params': dict,
+            'board_str': str,
+            'game_state': dict,
+            'andy_move': dict | None
+        }
+
+        andy_move (dict): Andy's move (see get_andy_move_response), or None if
+            Andy does not move next. Its board_str and game_state are the
+            latest ones.
+
+        The other fields are the same as for get-response.
+
+    """
+    if request.method == "POST":
+        received_at = datetime.now()
+        session_id = request.args.get('session_id')
+        detected_text = request.args.get('detected_text')
+        recording_time_ms = request.args.get('recording_time_ms', -1)
+        board_str = request.args.get('board_str')
+
+        # Make sure query params are present
+        if not session_id or not detected_text:
+            raise Exception("turn: missing session_id or detected_text")
+
+        user_response = await respond_to_user(
             session_id,
-            data={
-                "text": detected_text,
-                "audio_data": request.data,
-                "detected_intent": intent_query_response.intent.name if intent_query_response is not None else None,
-                "detected_fulfillment": fulfillment_info["intent_name"],
-                "fulfillment_success": fulfillment_info["success"],
-                "board_str_before": board_str,
-                "board_str_after": updated_board_str,
-                "received_at": received_at,
-                "response_at": response_at,
-                "recording_time_ms": float(recording_time_ms)
-            }
-        )).start()
-
-        return jsonify({
-            'response_text': response_text,
-            'fulfillment_info': fulfillment_info,
-            'fulfillment_params': get_fulfillment_params(session_id),
-            'board_str': updated_board_str,
-            'game_state': get_game_state(session_id)
-        })
+            detected_text,
+            board_str,
+            await request.get_data(),
+            get_upload_audio_type(request.mimetype),
+            recording_time_ms,
+            received_at
+        )
+        audio_format = get_audio_format(
+            request.args.get('audio_format'), request.accept_mimetypes)
+        if request.args.get('stream') == "true":
+            return stream_response(
+                stream_turn(
+                    session_id, user_response, audio_format, received_at),
+                TURN_STREAM_MIMETYPE
+            )
+
+        # Speak the response while Andy's move is determined
+        spoken_texts = [user_response["response_text"]]
+        audio_tasks = [asyncio.ensure_future(synthesize_speech_async(
+            user_response["response_text"], audio_format))]
+        andy_move = None
+        try:
+            if andy_moves_next(user_response):
+                andy_move = await make_andy_move(
+                    session_id, user_response["board_str"], received_at)
+                spoken_texts.append(andy_move["response_text"])
+                audio_tasks.append(asyncio.ensure_future(
+                    synthesize_speech_async(
+                        andy_move["response_text"], audio_format)))
+            speeches = await asyncio.gather(*audio_tasks)
+        finally:
+            # Stop speaking if Andy's move failed or the client went away
+            for task in audio_tasks:
+                task.cancel()
+
+        clips = []
+        for text, (response_audio, audio_type, err_msg) in zip(
+                spoken_texts, speeches):
+            await asyncio.to_thread(
+                log_spoken_response, session_id, text, response_audio,
+                audio_type, err_msg, received_at)
+            clips.append(response_audio)
+        if andy_move is None:
+            clips.append(None)
+
+        user_response["andy_move"] = andy_move
+        return Response(
+            pack_turn_response(user_response, *clips),
+            mimetype=TURN_RESPONSE_MIMETYPE
+        )
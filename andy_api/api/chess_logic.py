@@ -1,10 +1,16 @@
 from typing import Tuple, cast
 import chess
+import asyncio
 import chess.engine
 import os
 import random
+from collections import namedtuple
 
 from api.state_manager import get_game_state
+from .engine_pool import get_pool, init_pool, run_sync
+from .move_cache import best_move_cache
+from .opening_book import get_book_move
+from .tablebase import SYZYGY_LOCATION, get_tablebase_move
 
 # This is a relative location to the directory in which you run the script (aka, andy_api/)
 STOCKFISH_ENGINE_LOCATION = os.environ.get("STOCKFISH_LOCATION")
@@ -24,25 +30,362 @@ CHESS_PIECE_NAMES = {
     'K': 'king'
 }
 
+# Piece types, keyed by the spoken piece name
+PIECE_TYPES_BY_NAME = {
+    name: chess.Piece.from_symbol(symbol).piece_type
+    for symbol, name in CHESS_PIECE_NAMES.items()
+}
 
-def get_engine():
-    return chess.engine.SimpleEngine.popen_uci(STOCKFISH_ENGINE_LOCATION)
+# How strongly, and for how long, the engine searches at a difficulty.
+# Searches stop at whichever of time (seconds), nodes or depth comes first,
+# and None leaves that limit off. Skill levels below 20 make the engine pick
+# weaker moves at random. book_selection is how opening book moves are
+# chosen (see opening_book).
+DifficultyProfile = namedtuple(
+    "DifficultyProfile",
+    ["skill_level", "time", "nodes", "depth", "book_selection"])
+
+DIFFICULTY_PROFILES = {
+    "easy": DifficultyProfile(
+        skill_level=3, time=0.05, nodes=20000, depth=6,
+        book_selection="uniform"),
+    "medium": DifficultyProfile(
+        skill_level=10, time=0.1, nodes=200000, depth=12,
+        book_selection="weighted"),
+    "hard": DifficultyProfile(
+        skill_level=20, time=BEST_MOVE_ALGORITHM_TIME_LIMIT, nodes=None, depth=None,
+        book_selection="best")
+}
 
+# The profile used for the user's best-move hints
+BEST_MOVE_PROFILE = DIFFICULTY_PROFILES["hard"]
 
-def get_best_move(board_str):
-    engine = get_engine()
+# The result of playing a move on a BoardContext
+MoveOutcome = namedtuple(
+    "MoveOutcome", ["board_str", "is_check", "is_checkmate"])
+
+
+def init_engine_pool():
+    """Starts the pool of engine processes used for every search."""
+    init_pool(STOCKFISH_ENGINE_LOCATION)
+
+
+class IllegalMoveError(Exception):
+    pass
+
+
+class MultiplePiecesCanMoveError(Exception):
+    pass
+
+
+class MoveIndex:
+    """The legal moves of a position, indexed for spoken move lookups.
+
+    Moves are kept in a set and indexed by (piece type, to-square), so
+    checking a move like "e2 to e4" or resolving one like "knight to f3"
+    takes a single lookup.
+
+    """
+
+    def __init__(self, board):
+        self.moves = set()
+        self.by_piece_to = {}
+        for move in board.legal_moves:
+            piece_type = board.piece_type_at(move.from_square)
+            self.moves.add(move)
+            self.by_piece_to.setdefault(
+                (piece_type, move.to_square), []).append(move)
+
+    def moves_of_piece_to(self, piece_type, to_square):
+        return self.by_piece_to.get((piece_type, to_square), [])
+
+
+class BoardContext:
+    """A board parsed once from its FEN string, shared across a request.
+
+    Legal moves are generated and indexed (see MoveIndex) the first time
+    they are needed, and reused for every later check on the same position.
+
+    """
+
+    def __init__(self, board_str):
+        self.board_str = board_str
+        self.board = chess.Board(board_str)
+        self._move_index = None
+
+    @property
+    def move_index(self):
+        if self._move_index is None:
+            self._move_index = MoveIndex(self.board)
+        return self._move_index
+
+    @property
+    def legal_moves(self):
+        return self.move_index.moves
+
+    @property
+    def turn(self):
+        return self.board.turn
+
+    def is_check(self):
+        return self.board.is_check()
+
+    def is_checkmate(self):
+        return self.is_check() and not self.legal_moves
+
+    def piece_at(self, location):
+        return self.board.piece_at(chess.parse_square(location.lower()))
+
+    def piece_name_at(self, location):
+        if location:
+            piece = self.piece_at(location)
+            if piece:
+                return CHESS_PIECE_NAMES.get(piece.symbol().upper(), None)
+        return None
+
+    def owns_location(self, location):
+        board_location = chess.parse_square(location.lower())
+        return self.board.turn == self.board.color_at(board_location)
+
+    def is_move_legal(self, move_sequence):
+        try:
+            return chess.Move.from_uci(move_sequence.lower()) in self.legal_moves
+        except ValueError:
+            # Throws if locations are the same (for example, h1h1)
+            return False
+
+    def move_causes_check(self, move_sequence):
+        try:
+            move_to_make = chess.Move.from_uci(move_sequence.lower())
+        except ValueError:
+            # Throws if locations are the same (for example, h1h1)
+            return False
+        return self.board.is_pseudo_legal(move_to_make)
+
+    def play(self, move_sequence):
+        """Plays a move without changing this board.
+
+        Returns:
+            MoveOutcome: the FEN after the move, and whether the move gives
+                check or checkmate.
+
+        """
+        self.board.push_uci(move_sequence.lower())
+        try:
+            is_check = self.board.is_check()
+            is_checkmate = is_check and self.board.is_checkmate()
+            return MoveOutcome(self.board.fen(), is_check, is_checkmate)
+        finally:
+            self.board.pop()
+
+    def fallback_move(self):
+        """Returns a move without the engine, for when it is unavailable.
+
+        Plays checkmate if possible, then the most valuable capture, then a
+        check, and otherwise a random move.
+
+        """
+        moves = list(self.legal_moves)
+        best_capture = None
+        best_capture_value = 0
+        checks = []
+        for move in moves:
+            if self.board.gives_check(move):
+                if self.play(move.uci()).is_checkmate:
+                    return move.uci()
+                checks.append(move)
+            captured = self.board.piece_type_at(move.to_square)
+            if captured and captured > best_capture_value:
+                best_capture = move
+                best_capture_value = captured
+        if best_capture:
+            return best_capture.uci()
+        if checks:
+            return random.choice(checks).uci()
+        return random.choice(moves).uci()
+
+    def random_move(self):
+        return random.choice(list(self.legal_moves)).uci()
+
+    def castle_side(self, castle_side, user_side):
+        """Returns "king" or "queen" if the user can castle on that side."""
+        castle_side = castle_side.lower()
+        if(user_side == "white"):
+            user_side = chess.WHITE
+            if(castle_side == "left"):
+                castle_side = "queen"
+            elif(castle_side == "right"):
+                castle_side = "king"
+        if(user_side == "black"):
+            user_side = chess.BLACK
+            if(castle_side == "left"):
+                castle_side = "king"
+            elif(castle_side == "right"):
+                castle_side = "queen"
+        if self.board.has_castling_rights(user_side):
+            if ((castle_side == "king" and self.board.has_kingside_castling_rights(user_side)) or
+                    (castle_side == "queen" and self.board.has_queenside_castling_rights(user_side))):
+                return castle_side
+        else:
+            return None
+
+    def castle_locations(self, castle_side, user_side) -> Tuple[str, str]:
+        """Returns from_location, to_location"""
+        castle_side = self.castle_side(castle_side, user_side)
+        if castle_side == "king" and user_side == "white":
+            return 'E1', 'G1'
+        elif castle_side == "king" and user_side == "black":
+            return 'E8', 'G8'
+        elif castle_side == "queen" and user_side == "white":
+            return 'E1', 'C1'
+        else:
+            return 'E8', 'C8'
+
+    def from_location_from_move_info(self, move_info):
+        """Returns the square of the user's piece that can make a spoken move.
+
+        When no piece can legally make the move, a single piece that could
+        make it if it did not leave the king in check is still returned, so
+        the caller can explain why the move is illegal.
+
+        Raises:
+            IllegalMoveError: if none of the user's pieces can make the move.
+            MultiplePiecesCanMoveError: if more than one piece can make it.
+
+        """
+        to_square = chess.parse_square(move_info.get("to_location").lower())
+        piece_type = PIECE_TYPES_BY_NAME.get(
+            move_info.get("piece_name").lower())
+        if piece_type is None:
+            raise IllegalMoveError()
+
+        from_squares = {
+            move.from_square
+            for move in self.move_index.moves_of_piece_to(piece_type, to_square)
+        }
+        if not from_squares:
+            from_squares = {
+                move.from_square
+                for move in self.board.generate_pseudo_legal_moves(
+                    from_mask=self.board.pieces_mask(
+                        piece_type, self.board.turn),
+                    to_mask=chess.BB_SQUARES[to_square])
+            }
+
+        if len(from_squares) == 1:
+            return chess.square_name(from_squares.pop())
+        elif len(from_squares) > 1:
+            raise MultiplePiecesCanMoveError()
+        else:
+            raise IllegalMoveError()
+
+
+def get_difficulty_profile(difficulty):
+    """Returns the profile for a difficulty, or the easy profile if unknown."""
+    return DIFFICULTY_PROFILES.get(difficulty, DIFFICULTY_PROFILES["easy"])
+
+
+def get_engine_limit(profile):
+    return chess.engine.Limit(
+        time=profile.time, nodes=profile.nodes, depth=profile.depth)
+
+
+def get_engine_options(profile):
+    return {"Skill Level": profile.skill_level}
+
+
+async def get_best_move_async(board_str, profile=BEST_MOVE_PROFILE, background=False):
+    """Returns the engine's best move under a difficulty profile.
+
+    Positions in the opening book are answered without a search. At full
+    strength, positions in the endgame tablebases are too, and moves are
+    cached by position. Weakened moves are not, since the engine picks them
+    at random and should not play perfect endgames. Background searches (see
+    EnginePool._search) leave engines free for requests.
+
+    """
+    board = chess.Board(board_str)
+    book_move = get_book_move(board, profile.book_selection)
+    if book_move is not None:
+        return book_move
+    full_strength = profile.skill_level >= 20
+    if full_strength and SYZYGY_LOCATION:
+        # Probing reads the tables from disk, so keep it off the event loop
+        tablebase_move = await asyncio.get_running_loop().run_in_executor(
+            None, get_tablebase_move, board)
+        if tablebase_move is not None:
+            return tablebase_move
+    limit = get_engine_limit(profile)
+    cache_key = best_move_cache.key(board, profile)
+    best_move = best_move_cache.get(cache_key) if full_strength else None
+    if best_move is None:
+        pool = await get_pool(STOCKFISH_ENGINE_LOCATION)
+        result = await pool.play(
+            board, limit, background, options=get_engine_options(profile))
+        best_move = result.move.uci()
+        if full_strength:
+            best_move_cache.put(cache_key, best_move)
+    return best_move
+
+
+async def evaluate_position_async(board_str, profile=BEST_MOVE_PROFILE, limit=None):
+    """Analyses a position with the engine configuration of a profile.
+
+    Runs as batch analysis (see EnginePool._search), so it only takes
+    engines that are not needed by requests or other background work.
+
+    Args:
+        board_str: the state of the board, as text.
+        profile (DifficultyProfile): the profile whose engine options to use.
+        limit (chess.engine.Limit): overrides the profile's search limits.
+
+    Returns:
+        dict: the evaluation, with the score from white's point of view.
+
+        {
+            'score': {'cp': int | None, 'mate': int | None},
+            'best_move': str | None,
+            'pv': list
+        }
+
+    """
+    board = chess.Board(board_str)
+    limit = limit or get_engine_limit(profile)
+    pool = await get_pool(STOCKFISH_ENGINE_LOCATION)
+    info = await pool.analyse(
+        board, limit, options=get_engine_options(profile), batch=True)
+    score = info.get("score")
+    pv = [move.uci() for move in info.get("pv", [])]
+    return {
+        'score': {
+            'cp': score.white().score() if score else None,
+            'mate': score.white().mate() if score else None
+        },
+        'best_move': pv[0] if pv else None,
+        'pv': pv
+    }
+
+
+async def get_candidate_moves_async(board_str, count, limit, background=True):
+    """Returns the engine's top moves for a position, best first, as UCI strings."""
     board = chess.Board(board_str)
-    best_move = engine.play(board, chess.engine.Limit(
-        time=BEST_MOVE_ALGORITHM_TIME_LIMIT)).move
-    engine.quit()
-    return best_move.uci()
+    pool = await get_pool(STOCKFISH_ENGINE_LOCATION)
+    infos = await pool.analyse(
+        board, limit, background,
+        options=get_engine_options(BEST_MOVE_PROFILE), multipv=count)
+    return [info["pv"][0].uci() for info in infos if info.get("pv")]
+
+
+async def get_random_move_async(board_str):
+    return BoardContext(board_str).random_move()
+
+
+def get_best_move(board_str):
+    return run_sync(get_best_move_async(board_str))
 
 
 def get_random_move(board_str):
-    board = chess.Board(board_str)
-    legal_moves = list(board.legal_moves)
-    move = random.choice(legal_moves)
-    return move.uci()
+    return BoardContext(board_str).random_move()
 
 
 def get_board_str_with_move(board_str, move_sequence):
@@ -53,138 +396,47 @@ def get_board_str_with_move(board_str, move_sequence):
 
 def get_piece_name_at(board_str, location):
     if location:
-        board = chess.Board(board_str)
-        board_location = chess.parse_square(location.lower())
-        piece = board.piece_at(board_location)
-        if piece:
-            return CHESS_PIECE_NAMES.get(piece.symbol().upper(), None)
-        else:
-            return None
+        return BoardContext(board_str).piece_name_at(location)
     else:
         return None
 
 
 def check_if_check(board_str):
-    board = chess.Board(board_str)
-    return board.is_check()
+    return BoardContext(board_str).is_check()
 
 
 def check_if_checkmate(board_str):
-    board = chess.Board(board_str)
-    return board.is_checkmate()
+    return BoardContext(board_str).is_checkmate()
 
 
 def get_current_color_turn(board_str):
-    board = chess.Board(board_str)
-    return board.turn
+    return BoardContext(board_str).turn
 
 
 def get_piece_at(board_str, location):
-    board = chess.Board(board_str)
-    board_location = chess.parse_square(location.lower())
-    return board.piece_at(board_location)
+    return BoardContext(board_str).piece_at(location)
 
 
 def check_if_owns_location(board_str, location):
-    board = chess.Board(board_str)
-    board_location = chess.parse_square(location.lower())
-    return board.turn == board.color_at(board_location)
+    return BoardContext(board_str).owns_location(location)
 
 
 def check_if_move_legal(board_str, move_sequence):
-    board = chess.Board(board_str)
-    try:
-        return chess.Move.from_uci(move_sequence.lower()) in board.legal_moves
-    except ValueError:
-        # Throws if locations are the same (for example, h1h1)
-        return False
+    return BoardContext(board_str).is_move_legal(move_sequence)
 
 
 def check_if_move_causes_check(board_str, move_sequence):
-    board = chess.Board(board_str)
-    try:
-        move_to_make = chess.Move.from_uci(move_sequence.lower())
-    except ValueError:
-        # Throws if locations are the same (for example, h1h1)
-        return False
-    if move_to_make in board.pseudo_legal_moves:
-        return True
-    else:
-        return False
-
-
-class IllegalMoveError(Exception):
-    pass
-
-
-class MultiplePiecesCanMoveError(Exception):
-    pass
+    return BoardContext(board_str).move_causes_check(move_sequence)
 
 
 def get_castle_locations(board_str, castle_side, user_side) -> Tuple[str, str]:
     """Returns from_location, to_location"""
-    castle_side = check_castle(board_str, castle_side, user_side)
-    if castle_side == "king" and user_side == "white":
-        return 'E1', 'G1'
-    elif castle_side == "king" and user_side == "black":
-        return 'E8', 'G8'
-    elif castle_side == "queen" and user_side == "white":
-        return 'E1', 'C1'
-    else:
-        return 'E8', 'C8'
+    return BoardContext(board_str).castle_locations(castle_side, user_side)
 
 
 def check_castle(board_str, castle_side, user_side):
-    board = chess.Board(board_str)
-    castle_side = castle_side.lower()
-    if(user_side == "white"):
-        user_side = chess.WHITE
-        if(castle_side == "left"):
-            castle_side = "queen"
-        elif(castle_side == "right"):
-            castle_side = "king"
-    if(user_side == "black"):
-        user_side = chess.BLACK
-        if(castle_side == "left"):
-            castle_side = "king"
-        elif(castle_side == "right"):
-            castle_side = "queen"
-    if board.has_castling_rights(user_side):
-        if ((castle_side == "king" and board.has_kingside_castling_rights(user_side)) or
-                (castle_side == "queen" and board.has_queenside_castling_rights(user_side))):
-            return castle_side
-    else:
-        return None
+    return BoardContext(board_str).castle_side(castle_side, user_side)
 
 
 def get_from_location_from_move_info(board_str, move_info):
-    board = chess.Board(board_str)
-
-    to_location = move_info.get("to_location").lower()
-    piece_name = move_info.get("piece_name").lower()
-
-    # Get a list of all possible from locations based on to_location
-    potential_from_loc = []
-    for loc in chess.SQUARE_NAMES:
-        p = board.piece_at(chess.parse_square(loc))
-        if p and CHESS_PIECE_NAMES.get(p.symbol().upper()) == piece_name:
-            potential_from_loc.append(loc)
-
-    if len(potential_from_loc) == 1:
-        return potential_from_loc[0]
-    elif len(potential_from_loc) == 0:
-        raise IllegalMoveError()
-
-    actual_from_loc = []
-    for mv in board.pseudo_legal_moves:
-        from_loc = chess.square_name(mv.from_square)
-        to_loc = chess.square_name(mv.to_square)
-        if from_loc in potential_from_loc and to_loc == to_location:
-            actual_from_loc.append(from_loc)
-
-    if len(actual_from_loc) == 1:
-        return actual_from_loc[0]
-    elif len(actual_from_loc) > 1:
-        raise MultiplePiecesCanMoveError()
-    else:
-        raise IllegalMoveError()
+    return BoardContext(board_str).from_location_from_move_info(move_info)
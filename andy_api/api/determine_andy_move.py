@@ -1,18 +1,19 @@
 """This module will determine what Andy's move will be.
 
 """
+import asyncio
+import time
+import traceback
 from .intent_processing.utils import get_random_choice
-from .state_manager import set_game_finished, get_game_state
-from .chess_logic import (
-    get_board_str_with_move,
-    get_best_move,
-    get_random_move,
-    check_if_check,
-    check_if_checkmate,
-    get_piece_name_at
-)
+from .chess_logic import get_best_move_async, get_difficulty_profile
+from .engine_pool import run_async, ENGINE_REQUEST_BUDGET
+from .logging import log_error, ERROR_TYPES
 from .intent_processing.select_difficulty import STARTING_BOARD_STR
-import random
+from .ponder import start_ponder, take_pondered_reply
+from .precompute import PrecomputedResults
+
+# Andy's replies, started as soon as the user's move is known
+speculative_moves = PrecomputedResults("Andy move", ERROR_TYPES.ANDY_MOVE)
 
 
 HAPPY_PATH_RESPONSES = [
@@ -45,11 +46,55 @@ def get_prefix(original_board_str):
         return ""
 
 
-def determine_andy_move(session_id, board_str):
+async def choose_move_async(difficulty, board_str):
+    """Returns Andy's move, searched with the difficulty's engine profile."""
+    return await get_best_move_async(board_str, get_difficulty_profile(difficulty))
+
+
+def start_speculative_move(session_state, board_str):
+    """Starts computing Andy's reply to a board in the background.
+
+    Args:
+        session_state (SessionState): the state of the session.
+        board_str: the state of the board after the user's move, as text.
+
+    """
+    # Use the reply pondered while the user was thinking, even if it is
+    # still being searched
+    pondered_reply = take_pondered_reply(session_state.session_id, board_str)
+    if pondered_reply is not None:
+        speculative_moves.start(
+            session_state.session_id, board_str, pondered_reply)
+        return
+
+    difficulty = session_state.get_game_state()["difficulty_selection"]
+    speculative_moves.start(
+        session_state.session_id,
+        board_str,
+        choose_move_async(difficulty, board_str)
+    )
+
+
+def start_pondering(session_state, board_str):
+    """Starts pondering Andy's replies while the user thinks about a board.
+
+    Args:
+        session_state (SessionState): the state of the session.
+        board_str: the state of the board after Andy's move, as text.
+
+    """
+    difficulty = session_state.get_game_state()["difficulty_selection"]
+    start_ponder(session_state.session_id, difficulty, board_str)
+
+
+async def determine_andy_move(session_state, board):
     """Handles determining a text response for Andy's move.
 
+    Must be awaited on the app's event loop.
+
     Args:
-        board_str: the state of the board, as text.
+        session_state (SessionState): the state of the session.
+        board (BoardContext): the board before Andy's move.
 
     Returns:
         str: the response that should be given, as text.
@@ -57,40 +102,50 @@ def determine_andy_move(session_id, board_str):
         dict: the move_info to log.
 
     """
+    board_str = board.board_str
     static_choice = get_random_choice(HAPPY_PATH_RESPONSES)
 
-    # Get the best move or a random move depending on difficulty
-    game_state = get_game_state(session_id)
+    # Use the move computed while the user's move was acknowledged, if any
+    game_state = session_state.get_game_state()
     difficulty = game_state["difficulty_selection"]
-    if difficulty == "hard":
-        move = get_best_move(board_str)
-    else:
-        chance = random.randrange(1, 11)
-        if chance <= 4:
-            move = get_best_move(board_str)
-        else:
-            move = get_random_move(board_str)
+    # Never wait on the engine for longer than the request budget
+    deadline = time.monotonic() + ENGINE_REQUEST_BUDGET
+    move = await speculative_moves.take_async(
+        session_state.session_id, board_str, timeout=ENGINE_REQUEST_BUDGET)
+    if move is None:
+        try:
+            move = await run_async(
+                choose_move_async(difficulty, board_str),
+                timeout=max(deadline - time.monotonic(), 0))
+        except Exception:
+            err_msg = f"Error with calculating Andy's move, using a fallback move: {traceback.format_exc()}"
+            await asyncio.to_thread(
+                log_error, session_state.session_id, ERROR_TYPES.ANDY_MOVE,
+                err_msg)
+            move = board.fallback_move()
 
     # Get logging information
     from_location = move[0:2]
     to_location = move[2:4]
-    piece_name = get_piece_name_at(board_str, from_location)
+    piece_name = board.piece_name_at(from_location)
     move_info = {
         "from": from_location,
         "to": to_location
     }
 
     # Make the best move
-    updated_board_str = get_board_str_with_move(board_str, move)
+    outcome = board.play(move)
+    updated_board_str = outcome.board_str
+    session_state.record_move(board_str, move, False, updated_board_str)
 
-    if check_if_checkmate(updated_board_str):
-        set_game_finished(session_id)
+    if outcome.is_checkmate:
+        session_state.set_game_finished()
         suffix = get_random_choice(CHECKMATE_SUFFIXES)
         return static_choice.format(
             from_location=from_location,
             to_location=to_location,
             piece_name=piece_name) + suffix, updated_board_str, move_info
-    elif check_if_check(updated_board_str):
+    elif outcome.is_check:
         suffix = get_random_choice(CHECK_SUFFIXES)
         return static_choice.format(
             from_location=from_location,
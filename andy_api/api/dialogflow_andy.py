@@ -1,5 +1,8 @@
 """This module contains functions that are related to the Dialogflow API.
 
+Intents are detected with the async client on the app's event loop, so
+requests in flight share one gRPC channel and do not each hold a thread.
+
 Attributes:
     PROJECT_ID: the ID of the gcloud project.
     LANGUAGE_CODE: the language code of words being interpreted.
@@ -10,10 +13,24 @@ from google.cloud import dialogflow
 PROJECT_ID = "chess-master-andy-mhyo"
 LANGUAGE_CODE = "en-US"
 
+# Created on the app's event loop on first use
+_session_client = None
+
+
+def _get_session_client():
+    """Returns the shared async Dialogflow client. Must be called on the
+    app's event loop, which the client's channel is bound to."""
+    global _session_client
+    if _session_client is None:
+        _session_client = dialogflow.SessionsAsyncClient()
+    return _session_client
 
-def perform_intent_query(session_id, text):
+
+async def perform_intent_query_async(session_id, text):
     """Detects the intent from a user's words.
 
+    Must be awaited on the app's event loop.
+
     Args:
         session_id (str): the unique session ID to use for Dialogflow.
         text (str): the words that the user spoke.
@@ -22,7 +39,7 @@ def perform_intent_query(session_id, text):
         dict: the response generated by Dialogflow.
 
     """
-    session_client = dialogflow.SessionsClient()
+    session_client = _get_session_client()
 
     session = session_client.session_path(PROJECT_ID, session_id)
     print(f"Session path: {session}\n")
@@ -32,7 +49,7 @@ def perform_intent_query(session_id, text):
 
     query_input = dialogflow.QueryInput(text=text_input)
 
-    response = session_client.detect_intent(
+    response = await session_client.detect_intent(
         request={"session": session, "query_input": query_input}
     )
 
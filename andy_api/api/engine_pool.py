@@ -0,0 +1,304 @@
+"""Keeps a bounded pool of long-lived chess engine processes.
+
+Starting Stockfish (process spawn, UCI handshake and loading its network)
+often takes longer than the search itself, so engines are started once and
+reused across requests.
+
+Every engine is driven by the asyncio engine API on one shared event loop,
+which runs on a single background thread. Searches are awaited on that loop
+rather than each holding a thread, and a semaphore caps how many run at once.
+Background searches are limited further, so they cannot take every engine
+away from requests, and batch analysis waits for a background slot one
+search at a time, so other background work gets a turn in between.
+Synchronous callers submit coroutines to the loop with run_sync, and request
+handlers on the app's own event loop await them with run_async. Both give up
+after a wall-clock budget so no request stalls on the engine. Only engine
+work runs on this loop; the API's network calls, such as Dialogflow and
+text-to-speech, run on the app's event loop.
+
+Engines are supervised: each one is pinged (isready) when it is checked out,
+and an engine that fails the ping, errors or times out is closed and
+restarted. A cancelled search is stopped (UCI stop) and its engine is kept.
+
+Attributes:
+    ENGINE_POOL_SIZE: the number of engine processes to keep running.
+    ENGINE_MAX_SEARCHES: the number of searches allowed to run at once.
+    ENGINE_MAX_BACKGROUND_SEARCHES: the number of those searches that may be
+        background work, such as precomputed hints. By default one search
+        slot is always left for requests.
+    ENGINE_MAX_BATCH_SEARCHES: the number of background searches that may be
+        batch analysis (see EnginePool._search).
+    ENGINE_CHECKOUT_TIMEOUT: seconds to wait for a free engine.
+    ENGINE_COMMAND_TIMEOUT: seconds an engine has to answer a command, on
+        top of any search time limit.
+    ENGINE_PING_TIMEOUT: seconds an engine has to answer the liveness ping.
+    ENGINE_REQUEST_BUDGET: the most seconds a request waits on run_sync or
+        run_async.
+
+"""
+import asyncio
+import atexit
+import concurrent.futures
+import os
+import threading
+import traceback
+from contextlib import asynccontextmanager
+
+import chess.engine
+
+ENGINE_POOL_SIZE = int(os.environ.get("ENGINE_POOL_SIZE", 2))
+ENGINE_MAX_SEARCHES = int(
+    os.environ.get("ENGINE_MAX_SEARCHES", ENGINE_POOL_SIZE))
+ENGINE_MAX_BACKGROUND_SEARCHES = int(os.environ.get(
+    "ENGINE_MAX_BACKGROUND_SEARCHES", max(ENGINE_MAX_SEARCHES - 1, 1)))
+ENGINE_MAX_BATCH_SEARCHES = int(
+    os.environ.get("ENGINE_MAX_BATCH_SEARCHES", 1))
+ENGINE_CHECKOUT_TIMEOUT = float(os.environ.get("ENGINE_CHECKOUT_TIMEOUT", 5))
+ENGINE_COMMAND_TIMEOUT = float(os.environ.get("ENGINE_COMMAND_TIMEOUT", 10))
+ENGINE_PING_TIMEOUT = float(os.environ.get("ENGINE_PING_TIMEOUT", 1))
+ENGINE_REQUEST_BUDGET = float(os.environ.get("ENGINE_REQUEST_BUDGET", 2))
+
+# Errors after which an engine can no longer be trusted and is replaced.
+# A cancelled search is not one: python-chess tells the engine to stop, and
+# the next command waits for it to do so.
+ENGINE_FAILURES = (
+    chess.engine.EngineError,
+    chess.engine.EngineTerminatedError,
+    asyncio.TimeoutError,
+    TimeoutError
+)
+
+_pool = None
+_loop = None
+_loop_lock = threading.Lock()
+
+
+class EngineUnavailableError(Exception):
+    pass
+
+
+def get_loop():
+    """Returns the shared engine event loop, starting its thread on first use."""
+    global _loop
+    with _loop_lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            threading.Thread(
+                target=_loop.run_forever, name="engine-loop", daemon=True
+            ).start()
+        return _loop
+
+
+def run_sync(coro, timeout=ENGINE_REQUEST_BUDGET):
+    """Runs a coroutine on the shared engine loop and waits for its result.
+
+    Must not be called from the engine loop itself.
+
+    Raises:
+        EngineUnavailableError: if the coroutine did not finish within the
+            timeout. It is cancelled, which stops any search it was running.
+
+    """
+    future = asyncio.run_coroutine_threadsafe(coro, get_loop())
+    try:
+        return future.result(timeout=timeout)
+    except concurrent.futures.TimeoutError:
+        future.cancel()
+        raise EngineUnavailableError(
+            f"Engine did not answer within {timeout} seconds")
+
+
+async def run_async(coro, timeout=ENGINE_REQUEST_BUDGET):
+    """Runs a coroutine on the shared engine loop and awaits its result.
+
+    Must be awaited on another event loop, such as the app's.
+
+    Raises:
+        EngineUnavailableError: if the coroutine did not finish within the
+            timeout. It is cancelled, which stops any search it was running.
+
+    """
+    future = asyncio.run_coroutine_threadsafe(coro, get_loop())
+    try:
+        return await asyncio.wait_for(asyncio.wrap_future(future), timeout)
+    except asyncio.TimeoutError:
+        future.cancel()
+        raise EngineUnavailableError(
+            f"Engine did not answer within {timeout} seconds")
+
+
+class EnginePool:
+    """A bounded pool of engines that are checked out for each search.
+
+    Engines that crash or stop responding are closed, and a new process is
+    started in their place the next time the slot is checked out. Must be
+    created and used on the shared engine loop.
+
+    """
+
+    def __init__(self, engine_location, size, max_searches,
+                 max_background_searches, max_batch_searches):
+        self.engine_location = engine_location
+        self._engines = asyncio.Queue(maxsize=size)
+        self._searches = asyncio.Semaphore(max_searches)
+        self._background_searches = asyncio.Semaphore(max_background_searches)
+        self._batch_searches = asyncio.Semaphore(max_batch_searches)
+
+    async def start(self):
+        """Starts every engine in the pool."""
+        engines = await asyncio.gather(
+            *[self._start_engine() for _ in range(self._engines.maxsize)])
+        for engine in engines:
+            self._engines.put_nowait(engine)
+
+    async def _start_engine(self):
+        """Starts an engine, or returns None so a later checkout retries."""
+        try:
+            _, engine = await asyncio.wait_for(
+                chess.engine.popen_uci(self.engine_location),
+                ENGINE_COMMAND_TIMEOUT)
+            return engine
+        except Exception:
+            print(f"Failed to start engine: {traceback.format_exc()}")
+            return None
+
+    async def _check_engine(self, engine):
+        """Returns the engine if it answers a ping, otherwise a new engine."""
+        if engine is not None:
+            try:
+                await asyncio.wait_for(engine.ping(), ENGINE_PING_TIMEOUT)
+                return engine
+            except ENGINE_FAILURES:
+                print(f"Restarting unresponsive engine: {traceback.format_exc()}")
+                await close_engine(engine, graceful=False)
+        return await self._start_engine()
+
+    @asynccontextmanager
+    async def engine(self, timeout=ENGINE_CHECKOUT_TIMEOUT):
+        """Checks out an engine for the duration of an async with statement.
+
+        Raises:
+            EngineUnavailableError: if no engine could be checked out in time.
+
+        """
+        try:
+            await asyncio.wait_for(self._searches.acquire(), timeout)
+        except asyncio.TimeoutError:
+            raise EngineUnavailableError("Timed out waiting for a search slot")
+
+        try:
+            try:
+                engine = await asyncio.wait_for(self._engines.get(), timeout)
+            except asyncio.TimeoutError:
+                raise EngineUnavailableError("Timed out waiting for an engine")
+
+            try:
+                engine = await self._check_engine(engine)
+                if engine is None:
+                    raise EngineUnavailableError("Failed to start an engine")
+                yield engine
+            except ENGINE_FAILURES:
+                # Replace the engine the next time this slot is checked out
+                await close_engine(engine, graceful=False)
+                engine = None
+                raise
+            finally:
+                self._engines.put_nowait(engine)
+        finally:
+            self._searches.release()
+
+    async def play(self, board, limit, background=False, options=None):
+        """Plays a position on a pooled engine (see _search)."""
+        return await self._search(
+            lambda engine: engine.play(board, limit, options=options or {}),
+            limit, background)
+
+    async def analyse(self, board, limit, background=False, options=None,
+                      multipv=None, batch=False):
+        """Analyses a position on a pooled engine (see _search).
+
+        Returns a list of infos, best line first, if multipv is given.
+
+        """
+        return await self._search(
+            lambda engine: engine.analyse(
+                board, limit, multipv=multipv, options=options or {}),
+            limit, background, batch)
+
+    async def _search(self, search, limit, background, batch=False):
+        """Runs a search on a pooled engine, with a hard timeout.
+
+        Options (such as "Skill Level") only apply to this search. Background
+        searches wait for a background slot first, with no timeout, and then
+        compete for an engine like any other search. Batch searches are
+        background searches that also wait for a batch slot, so only
+        ENGINE_MAX_BATCH_SEARCHES of them queue for background slots at once
+        and hints and pondering are not starved by a large batch.
+
+        """
+        if batch:
+            async with self._batch_searches:
+                return await self._search(search, limit, True)
+        if background:
+            async with self._background_searches:
+                return await self._search(search, limit, False)
+        async with self.engine() as engine:
+            return await asyncio.wait_for(
+                search(engine), (limit.time or 0) + ENGINE_COMMAND_TIMEOUT)
+
+    async def close(self):
+        """Stops every engine that is not checked out."""
+        while not self._engines.empty():
+            await close_engine(self._engines.get_nowait())
+
+
+async def close_engine(engine, graceful=True):
+    """Stops an engine, ignoring errors from engines that already died.
+
+    Engines that failed are killed right away rather than asked to quit.
+
+    """
+    if engine is None:
+        return
+    try:
+        if not graceful:
+            raise EngineUnavailableError("Engine failed")
+        await asyncio.wait_for(engine.quit(), ENGINE_COMMAND_TIMEOUT)
+    except Exception:
+        if engine.transport is not None:
+            engine.transport.close()
+
+
+async def get_pool(engine_location):
+    """Returns the shared engine pool, starting it on the first call.
+
+    Must be awaited on the shared engine loop.
+
+    """
+    global _pool
+    if _pool is None:
+        pool = EnginePool(
+            engine_location,
+            ENGINE_POOL_SIZE,
+            ENGINE_MAX_SEARCHES,
+            ENGINE_MAX_BACKGROUND_SEARCHES,
+            ENGINE_MAX_BATCH_SEARCHES
+        )
+        await pool.start()
+        if _pool is None:
+            _pool = pool
+            atexit.register(_close_pool)
+        else:
+            # Another caller started the pool while this one was starting
+            await pool.close()
+    return _pool
+
+
+def _close_pool():
+    run_sync(_pool.close(), timeout=None)
+    _loop.call_soon_threadsafe(_loop.stop)
+
+
+def init_pool(engine_location):
+    """Starts the shared engine pool from a synchronous caller."""
+    return run_sync(get_pool(engine_location), timeout=None)
@@ -1,11 +1,16 @@
 """
 TODO add info about intent
 """
+import time
 import traceback
 from api.logging import log_error, ERROR_TYPES
-from api.chess_logic import get_best_move, get_piece_name_at
+from api.chess_logic import get_best_move_async, get_piece_name_at
+from api.engine_pool import run_sync, ENGINE_REQUEST_BUDGET
+from api.precompute import PrecomputedResults
 from .utils import get_random_choice
-from api.state_manager import set_fulfillment_params
+
+# The user's best moves, analysed once the board passes back to the user
+best_move_hints = PrecomputedResults("best move hint", ERROR_TYPES.BEST_MOVE)
 
 HAPPY_PATH_RESPONSES = [
     "I'd reccomend moving your {piece_name} from {from_location} to {to_location}.",
@@ -19,18 +24,31 @@ ERROR_RESPONSES = [
 ]
 
 
-def handle(session_id, board_str):
+def start_best_move_hint(session_id, board_str):
+    """Starts a low-priority analysis of the user's best move for a board."""
+    best_move_hints.start(
+        session_id, board_str, get_best_move_async(board_str, background=True))
+
+
+def handle(session_state, board_str):
     """TODO add details about method
     """
     static_choice = get_random_choice(HAPPY_PATH_RESPONSES)
     try:
-        best_move = get_best_move(board_str)
+        # Never wait on the engine for longer than the request budget
+        deadline = time.monotonic() + ENGINE_REQUEST_BUDGET
+        best_move = best_move_hints.take(
+            session_state.session_id, board_str, timeout=ENGINE_REQUEST_BUDGET)
+        if best_move is None:
+            best_move = run_sync(
+                get_best_move_async(board_str),
+                timeout=max(deadline - time.monotonic(), 0))
 
         from_location = best_move[0:2]
         to_location = best_move[2:4]
         piece_name = get_piece_name_at(board_str, from_location)
 
-        set_fulfillment_params(session_id, params={
+        session_state.set_fulfillment_params(params={
             "from_location": from_location,
             "to_location": to_location,
             "piece_name": piece_name,
@@ -43,6 +61,6 @@ def handle(session_id, board_str):
         ), True
     except Exception:
         err_msg = f"Error with calculating best move for user: {traceback.format_exc()}"
-        log_error(session_id, ERROR_TYPES.BEST_MOVE, err_msg)
+        log_error(session_state.session_id, ERROR_TYPES.BEST_MOVE, err_msg)
         static_choice = get_random_choice(ERROR_RESPONSES)
         return static_choice, False
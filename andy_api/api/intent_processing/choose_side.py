@@ -6,7 +6,6 @@ Attributes:
 
 """
 from .utils import get_random_choice
-from api.state_manager import set_chosen_side, set_fulfillment_params
 
 HAPPY_PATH_RESPONSES = [
     "Okay, you'll go {user_position}.",
@@ -26,10 +25,11 @@ ERROR_RESPONSES = [
 
 
 # TODO: add logic with board_str
-def handle(session_id, intent_model):
+def handle(session_state, intent_model):
     """Handles choosing a response for the CHOOSE_SIDE intent.
 
     Args:
+        session_state (SessionState): the state of the session.
         intent_model: the intent model to parse.
 
     Returns:
@@ -58,10 +58,10 @@ def handle(session_id, intent_model):
             user_position = second_pos
 
         # Update game state
-        set_chosen_side(session_id, user_side)
+        session_state.set_chosen_side(user_side)
 
         # Log the params
-        set_fulfillment_params(session_id, params={
+        session_state.set_fulfillment_params(params={
             "chosen_side": user_side
         })
 
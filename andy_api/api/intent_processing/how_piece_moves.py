@@ -3,8 +3,6 @@ TODO add info about intent
 """
 
 from .utils import get_random_choice
-from api.state_manager import set_fulfillment_params
-from api.chess_logic import get_piece_name_at
 
 # TODO: add this functionality:
 # Additionally, kings are able to make a special move, known as castling.
@@ -60,11 +58,11 @@ STANDARD_ERROR_RESPONSES = [
 ]
 
 
-def get_prefix(board_str, piece_name, piece_location):
+def get_prefix(board, piece_name, piece_location):
     # There may or may not be a piece_location, but there is always a piece_name
     if not piece_location:
         return ""
-    actual_piece_name = get_piece_name_at(board_str, piece_location)
+    actual_piece_name = board.piece_name_at(piece_location)
     # Piece names do not match AND actual piece name is not none
     if piece_name.lower() != actual_piece_name and actual_piece_name:
         return get_random_choice(PIECE_NAME_MISMATCH_PREFIXES).format(
@@ -81,24 +79,24 @@ def get_prefix(board_str, piece_name, piece_location):
         return get_random_choice(EMPTY_SPACE_WITH_PIECE_NAME_PREFIXES) + " "
 
 
-def handle(session_id, intent_data, board_str):
+def handle(session_state, intent_data, board):
     piece_location = intent_data.parameters["pieceLocation"] or None
     piece_name = intent_data.parameters["pieceName"] or None
 
     if piece_location or piece_name:
         if not piece_name:
             # There is a piece_location, but not a piece name
-            piece_name = get_piece_name_at(board_str, piece_location)
+            piece_name = board.piece_name_at(piece_location)
             if not piece_name:
                 static_choice = get_random_choice(
                     EMPTY_SPACE_RESPONSE)
                 return static_choice.format(piece_location=piece_location), False
 
         piece_name = piece_name.lower()
-        prefix = get_prefix(board_str, piece_name, piece_location)
+        prefix = get_prefix(board, piece_name, piece_location)
 
         # Update the fulfillment params
-        set_fulfillment_params(session_id, {
+        session_state.set_fulfillment_params({
             "piece_name": piece_name,
             "piece_location": piece_location
         })
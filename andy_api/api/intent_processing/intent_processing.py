@@ -27,8 +27,8 @@ Example Intent Model:
         language_code: "en"
     }
 """
-from api.state_manager import get_game_state
 from .utils import INTENT_MAPPING, RESPONSE_TYPES, get_random_choice
+from api.chess_logic import BoardContext
 from . import (
     choose_side,
     move_piece,
@@ -67,10 +67,11 @@ STATIC_RESPONSES = {
 }
 
 
-def fulfill_intent(session_id, board_str, intent_data):
+def fulfill_intent(session_state, board_str, intent_data):
     """Fulfills an intent, performing any actions and generating a response.
     Args:
-        session_id (str): the session ID provided by the client.
+        session_state (SessionState): the state of the session, loaded once
+            for the request.
         board_str (str): the FEN string representation of the board.
         intent_data (dict): the intent query response generated by Dialogflow.
     Returns:
@@ -91,7 +92,7 @@ def fulfill_intent(session_id, board_str, intent_data):
     updated_board_str = board_str
 
     # Get the game state
-    game_state = get_game_state(session_id)
+    game_state = session_state.get_game_state()
 
     # Intents to handle at any stage of an interaction
     if response_type == RESPONSE_TYPES.FALLBACK:
@@ -114,43 +115,45 @@ def fulfill_intent(session_id, board_str, intent_data):
             response_choice, success = start_game.handle()
         elif response_type == RESPONSE_TYPES.CHOOSE_SIDE:
             response_choice, success = choose_side.handle(
-                session_id, intent_data)
+                session_state, intent_data)
         elif response_type == RESPONSE_TYPES.SELECT_DIFFICULTY:
             response_choice, success, updated_board_str = select_difficulty.handle(
-                session_id, intent_data)
+                session_state, intent_data)
         else:
             response_type = RESPONSE_TYPES.FALLBACK
             success = False
 
     # Intents to handle after a game has started and the user has chosen a side
     elif not game_state["game_finished"]:
+        # Parse the board once for every chess check made by the intent
+        board = BoardContext(board_str)
         if response_type == RESPONSE_TYPES.MOVE_PIECE:
             response_choice, success, updated_board_str = move_piece.handle(
-                session_id, intent_data, board_str)
+                session_state, intent_data, board)
         elif response_type == RESPONSE_TYPES.CASTLE:
             response_choice, success, updated_board_str = castle.handle(
-                session_id, intent_data, board_str)
+                session_state, intent_data, board)
         elif response_type == RESPONSE_TYPES.HOW_PIECE_MOVES:
             response_choice, success = how_piece_moves.handle(
-                session_id, intent_data, board_str)
+                session_state, intent_data, board)
         elif response_type == RESPONSE_TYPES.BEST_MOVE:
-            response_choice, success = best_move.handle(session_id, board_str)
+            response_choice, success = best_move.handle(session_state, board_str)
         elif response_type == RESPONSE_TYPES.POSSIBLE_ACTIONS:
             response_choice, success = possible_actions.handle()
         elif response_type == RESPONSE_TYPES.RESTART_GAME:
             response_choice, success = restart_game.handle()
         elif response_type == RESPONSE_TYPES.RESTART_GAME_YES:
             response_choice, success, updated_board_str = restart_game_yes.handle(
-                session_id, board_str)
+                session_state, board_str)
         elif response_type == RESPONSE_TYPES.RESTART_GAME_NO:
             response_choice, success = restart_game_no.handle()
         elif response_type == RESPONSE_TYPES.UNDO_MOVE:
             response_choice, success, updated_board_str = undo_move.handle(
-                session_id, board_str)
+                session_state, board_str)
         elif response_type == RESPONSE_TYPES.QUIT_GAME:
             response_choice, success = quit_game.handle()
         elif response_type == RESPONSE_TYPES.QUIT_GAME_YES:
-            response_choice, success = quit_game.handle_yes(session_id)
+            response_choice, success = quit_game.handle_yes(session_state)
         elif response_type == RESPONSE_TYPES.QUIT_GAME_NO:
             response_choice, success = quit_game.handle_no()
         else:
@@ -1,17 +1,7 @@
 """This module handles intent processing for MOVE_PIECE.
 """
 from .utils import get_random_choice
-from api.state_manager import set_fulfillment_params, get_game_state, set_game_finished, get_board_stack, set_board_stack, set_gave_initial_possible_actions
 from api.chess_logic import (
-    check_if_check,
-    check_if_checkmate,
-    get_board_str_with_move,
-    get_piece_at,
-    check_if_move_legal,
-    check_if_owns_location,
-    check_if_move_causes_check,
-    get_from_location_from_move_info,
-    get_piece_name_at,
     IllegalMoveError,
     MultiplePiecesCanMoveError
 )
@@ -74,14 +64,17 @@ NEED_TO_LOCATION_ERROR_RESPONSES = [
 ]
 
 
-def handle(session_id, intent_model, board_str):
+def handle(session_state, intent_model, board):
     """Handles choosing a response for the MOVE_PIECE intent.
     Args:
+        session_state (SessionState): the state of the session.
         intent_model: the intent model to parse.
+        board (BoardContext): the board before the move.
     Returns:
         str: the response that should be given, as text.
         boolean: whether or not the intent was handled successfully.
     """
+    board_str = board.board_str
     if intent_model.all_required_params_present is True:
         # Get piece locations
         locations = intent_model.parameters["locations"]
@@ -100,8 +93,7 @@ def handle(session_id, intent_model, board_str):
                 "piece_name": piece_name,
             }
             try:
-                from_location = get_from_location_from_move_info(
-                    board_str, move_info)
+                from_location = board.from_location_from_move_info(move_info)
             except IllegalMoveError:
                 static_choice = get_random_choice(ILLEGAL_MOVE_ERROR_RESPONSES)
 
@@ -117,59 +109,57 @@ def handle(session_id, intent_model, board_str):
             return static_choice, False, board_str
 
         # Log the fulfillment params
-        set_fulfillment_params(session_id, params={
+        session_state.set_fulfillment_params(params={
             "from_location": from_location,
             "to_location": to_location
         })
 
         # Chess logic
-        if not get_piece_at(board_str, from_location):
+        if not board.piece_at(from_location):
             # No piece at that location
             static_choice = get_random_choice(EMPTY_SPACE_ERROR_RESPONSES)
             return static_choice.format(from_location=from_location), False, board_str
-        elif not check_if_owns_location(board_str, from_location):
+        elif not board.owns_location(from_location):
             # Player does not own that piece
             static_choice = get_random_choice(WRONG_COLOR_ERROR_RESPONSES)
 
             return static_choice, False, board_str
 
         # Check if the move is legal
-        if check_if_move_legal(board_str, from_location + to_location):
+        if board.is_move_legal(from_location + to_location):
 
             # Update the board_str
-            updated_board_str = get_board_str_with_move(
-                board_str, from_location + to_location)
+            outcome = board.play(from_location + to_location)
+            updated_board_str = outcome.board_str
 
             # Get the response
             static_choice = get_random_choice(HAPPY_PATH_RESPONSES)
 
             # check if user has put andy in check or checkmate
-            if check_if_checkmate(updated_board_str):
+            if outcome.is_checkmate:
                 static_choice += ' ' + get_random_choice(CHECKMATE_SUFFIXES)
-                set_game_finished(session_id)
+                session_state.set_game_finished()
                 # Log the fulfillment params with a victory
-                set_fulfillment_params(session_id, params={
+                session_state.set_fulfillment_params(params={
                     "from_location": from_location,
                     "to_location": to_location,
                     "won": True
                 })
-            elif check_if_check(updated_board_str):
+            elif outcome.is_check:
                 static_choice += ' ' + get_random_choice(CHECK_SUFFIXES)
 
             # Get the piece name
-            actual_piece_name = get_piece_name_at(board_str, from_location)
+            actual_piece_name = board.piece_name_at(from_location)
 
-            # Update stack of board strings with last board string before move
-            board_stack = get_board_stack(session_id)
-            board_stack.append(board_str)
-            set_board_stack(session_id, board_stack)
+            # Append the move to the move log
+            session_state.record_move(
+                board_str, from_location + to_location, True, updated_board_str)
 
             # Add first move suffix, if needed
-            if not get_game_state(
-                    session_id)["gave_initial_possible_actions"]:
+            if not session_state.get_game_state()["gave_initial_possible_actions"]:
                 static_choice += ' ' + \
                     get_random_choice(FIRST_MOVE_SUFFIXES)
-                set_gave_initial_possible_actions(session_id)
+                session_state.set_gave_initial_possible_actions()
 
             return static_choice.format(
                 piece_name=actual_piece_name,
@@ -180,7 +170,7 @@ def handle(session_id, intent_model, board_str):
             static_choice = get_random_choice(ILLEGAL_MOVE_ERROR_RESPONSES)
 
             # Check if move results in check
-            if check_if_move_causes_check(board_str, from_location + to_location):
+            if board.move_causes_check(from_location + to_location):
                 static_choice = get_random_choice(
                     MOVE_CAUSES_CHECK_ERROR_RESPONSES)
 
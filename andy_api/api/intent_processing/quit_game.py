@@ -2,7 +2,6 @@
 This module handles intent processing for QUIT_GAME and its followup intents.
 """
 from .utils import get_random_choice
-from api.state_manager import set_game_finished, set_fulfillment_params
 
 PROMPT_RESPONSES = [
     "It sounds like you're all done - would you like to quit?",
@@ -24,10 +23,10 @@ def handle():
     return get_random_choice(PROMPT_RESPONSES), True
 
 
-def handle_yes(session_id):
-    set_game_finished(session_id)
+def handle_yes(session_state):
+    session_state.set_game_finished()
     # Log the fulfillment params with a defeat
-    set_fulfillment_params(session_id, params={
+    session_state.set_fulfillment_params(params={
         "won": False
     })
 
@@ -4,8 +4,6 @@ TODO add info about intent
 
 from .utils import get_random_choice
 from .select_difficulty import STARTING_BOARD_STR
-from api.state_manager import set_fulfillment_params
-from api.state_manager import restart_game
 
 HAPPY_PATH_RESPONSES = [
     "Okay - let's try a new game then.",
@@ -13,13 +11,13 @@ HAPPY_PATH_RESPONSES = [
 ]
 
 
-def handle(session_id, board_str):
+def handle(session_state, board_str):
     static_choice = get_random_choice(HAPPY_PATH_RESPONSES)
 
-    restart_game(session_id)
+    session_state.restart_game()
 
     # Log the fulfillment params
-    set_fulfillment_params(session_id, params={
+    session_state.set_fulfillment_params(params={
         "curr_board_str": board_str,
         "updated_board_str": STARTING_BOARD_STR
     })
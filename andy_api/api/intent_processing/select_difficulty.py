@@ -4,7 +4,6 @@ TODO add info about intent
 
 import os
 from .utils import get_random_choice
-from api.state_manager import set_game_started, set_difficulty_selection, set_fulfillment_params, get_game_state
 
 import chess
 
@@ -30,8 +29,8 @@ ERROR_RESPONSES = [
 ]
 
 
-def get_suffix(session_id):
-    game_state = get_game_state(session_id)
+def get_suffix(session_state):
+    game_state = session_state.get_game_state()
     chosen_side = game_state["chosen_side"]
 
     if chosen_side == "white":
@@ -40,19 +39,19 @@ def get_suffix(session_id):
         return ""
 
 
-def handle(session_id, intent_model):
+def handle(session_state, intent_model):
     if intent_model.all_required_params_present is True:
         static_choice = get_random_choice(HAPPY_PATH_RESPONSES)
         difficulty_selection = intent_model.parameters["DifficultySelection"]
         difficulty_selection = difficulty_selection.lower()
-        suffix = get_suffix(session_id)
+        suffix = get_suffix(session_state)
 
         # Update game state.
-        set_game_started(session_id)
-        set_difficulty_selection(session_id, difficulty_selection)
+        session_state.set_game_started()
+        session_state.set_difficulty_selection(difficulty_selection)
 
         # Log the fulfillment params.
-        set_fulfillment_params(session_id, params={
+        session_state.set_fulfillment_params(params={
             "difficulty_selection": difficulty_selection
         })
 
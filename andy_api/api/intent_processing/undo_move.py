@@ -1,4 +1,3 @@
-from api.state_manager import set_fulfillment_params, get_board_stack, set_board_stack
 from .utils import get_random_choice
 
 HAPPY_PATH_RESPONSES = [
@@ -13,24 +12,21 @@ ERROR_RESPONSES = [
 ]
 
 
-def handle(session_id, board_str):
+def handle(session_state, board_str):
     """TODO add details about method
     """
 
     static_choice = get_random_choice(HAPPY_PATH_RESPONSES)
 
-    # Update board stack and grab board string before user made last move.
-    board_stack = get_board_stack(session_id)
-    if len(board_stack) == 0:
+    # Rebuild the board string from before the user made their last move.
+    updated_board_str = session_state.undo_user_move()
+    if updated_board_str is None:
         return get_random_choice(ERROR_RESPONSES), False, board_str
-    updated_board_str = board_stack.pop()
 
     # Log the fulfillment params
-    set_fulfillment_params(session_id, params={
+    session_state.set_fulfillment_params(params={
         "curr_board_str": board_str,
         "updated_board_str": updated_board_str
     })
 
-    set_board_stack(session_id, board_stack)
-
     return static_choice, True, updated_board_str
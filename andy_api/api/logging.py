@@ -79,15 +79,31 @@ Help Response Log:
         "error_desc": list(str),
     }
 
+Log Pipeline:
+    The log functions only snapshot the session's state and enqueue the log,
+    so no logging I/O happens on the request path. A single writer thread
+    commits the logs to Firestore in WriteBatches, in the order they were
+    enqueued. When it takes a batch from the queue, the batch's audio is
+    uploaded by a pool of workers, so logs that are dropped are never
+    uploaded. When the
+    queue is full, logs wait up to LOG_ENQUEUE_TIMEOUT seconds for space and
+    are then dropped. A batch that fails to commit is retried once, and its
+    logs are dropped if it fails again. Queued logs are written before the
+    process exits.
+
 """
+import atexit
 import os
+import queue
+import threading
 import traceback
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from enum import Enum
 from google.cloud import firestore
 
 from .state_manager import get_fulfillment_params, set_curr_log_id, get_curr_log_id, set_curr_errors, get_curr_errors
-from .speech_text_processing import upload_audio_file
+from .speech_text_processing import upload_audio_file, FILE_TYPE
 
 PROJECT_ID = "chess-master-andy-mhyo"
 LOGGING_SUFFIX = os.environ['LOGGING_SUFFIX']
@@ -100,11 +116,34 @@ USER_REQUEST_LOGS_COLLECTION = f"{USER_REQUEST_LOGS_BASE_COLLECTION}_{LOGGING_SU
 ANDY_RESPONSE_LOGS_COLLECTION = f"{ANDY_RESPONSE_LOGS_BASE_COLLECTION}_{LOGGING_SUFFIX}"
 HELP_RESPONSE_LOGS_COLLECTION = f"{HELP_RESPONSE_LOGS_BASE_COLLECTION}_{LOGGING_SUFFIX}"
 
+# The most logs waiting to be written
+LOG_QUEUE_SIZE = int(os.environ.get("LOG_QUEUE_SIZE", 1000))
+# The most logs committed in one WriteBatch (Firestore allows 500 writes,
+# and a linked log takes two)
+LOG_BATCH_SIZE = min(int(os.environ.get("LOG_BATCH_SIZE", 100)), 250)
+# The number of threads uploading audio
+LOG_UPLOAD_WORKERS = int(os.environ.get("LOG_UPLOAD_WORKERS", 4))
+# Seconds a request waits for space in a full queue before dropping its log
+LOG_ENQUEUE_TIMEOUT = float(os.environ.get("LOG_ENQUEUE_TIMEOUT", 0))
+# Attempts to commit a batch of logs before they are dropped
+LOG_WRITE_ATTEMPTS = 2
+# Seconds to spend writing queued logs when the process exits
+LOG_DRAIN_TIMEOUT = float(os.environ.get("LOG_DRAIN_TIMEOUT", 30))
+
 ERROR_TYPES = Enum(
     "ERROR_TYPES",
-    "INTENT FULFILLMENT TTS LOGGING AUDIO_UPLOAD BEST_MOVE UNKNOWN"
+    "INTENT FULFILLMENT TTS LOGGING AUDIO_UPLOAD BEST_MOVE ANDY_MOVE UNKNOWN"
 )
 
+_client = None
+_client_lock = threading.Lock()
+_log_queue = queue.Queue(maxsize=LOG_QUEUE_SIZE)
+_upload_executor = ThreadPoolExecutor(
+    max_workers=LOG_UPLOAD_WORKERS, thread_name_prefix="log-upload")
+_writer_thread = None
+_writer_lock = threading.Lock()
+_dropped_logs = 0
+
 
 def compute_request_time(start, end):
     """Returns the time (ms) between end and start."""
@@ -123,35 +162,202 @@ def log_error(session_id, err_type, err_desc):
     print_error(err_type, err_desc)
 
 
-def log_help_response(session_id, data):
-    # Upload audio_data and get name
+def get_client():
+    """Returns the shared Firestore client."""
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = firestore.Client(project=PROJECT_ID)
+        return _client
+
+
+class PendingLog:
+    """A log document waiting to be written.
+
+    Args:
+        doc_ref: the document to write, with its ID already chosen.
+        doc (dict): the fields of the log, without audio_name and errors.
+        error_types (list): the session's error types when it was logged.
+        error_desc (list): the session's error descriptions.
+        audio_data (bytes): audio to upload, or None for logs without audio.
+        audio_type (str): the content type of the audio, or None for WAV.
+        audio_error (str): the error message if the audio upload fails.
+        link_to: the user request document to link this log to, or None.
+
+    """
+
+    def __init__(self, doc_ref, doc, error_types, error_desc,
+                 audio_data=None, audio_type=None, audio_error=None,
+                 link_to=None):
+        self.doc_ref = doc_ref
+        self.doc = doc
+        self.error_types = list(error_types)
+        self.error_desc = list(error_desc)
+        self.audio_data = audio_data
+        self.audio_type = audio_type
+        self.audio_error = audio_error
+        self.link_to = link_to
+        self.audio_name = None
+
+    def start_upload(self):
+        """Starts uploading the log's audio, if it has any."""
+        if self.audio_data is not None:
+            self.audio_name = _upload_executor.submit(
+                upload_audio_file, self.audio_data,
+                self.audio_type or FILE_TYPE)
+            self.audio_data = None
+
+    def add_to(self, batch):
+        """Waits for the audio upload, then adds the log's writes to a batch."""
+        if self.audio_name is not None:
+            try:
+                self.doc['audio_name'] = self.audio_name.result()
+            except Exception:
+                self.doc['audio_name'] = ""
+                err_msg = f"{self.audio_error}: {traceback.format_exc()}"
+                self.error_types.append(ERROR_TYPES.AUDIO_UPLOAD.name)
+                self.error_desc.append(err_msg)
+                print_error(ERROR_TYPES.AUDIO_UPLOAD, err_msg)
+            # The upload is only waited on once if the batch is retried
+            self.audio_name = None
+        doc = dict(self.doc)
+        doc['errors_occurred'] = len(self.error_types) > 0
+        doc['error_types'] = self.error_types
+        doc['error_desc'] = self.error_desc
+        batch.set(self.doc_ref, doc)
+        if self.link_to is not None:
+            # Link to the request log
+            batch.set(self.link_to, {
+                'linked_logs': [self.doc_ref]
+            }, merge=True)
+
+
+def _count_dropped(count):
+    global _dropped_logs
+    with _writer_lock:
+        _dropped_logs += count
+        return _dropped_logs
+
+
+def _write_batch(logs):
+    """Commits logs in one WriteBatch, retrying once before dropping them."""
+    for attempt in range(LOG_WRITE_ATTEMPTS):
+        try:
+            batch = get_client().batch()
+            for log in logs:
+                log.add_to(batch)
+            batch.commit()
+            return
+        except Exception:
+            err_msg = f"Error writing {len(logs)} logs: {traceback.format_exc()}"
+            print_error(ERROR_TYPES.LOGGING, err_msg)
+    dropped = _count_dropped(len(logs))
+    print_error(
+        ERROR_TYPES.LOGGING,
+        f"Dropped {len(logs)} logs that could not be written ({dropped} dropped so far)")
+
+
+def _write_loop():
+    """Writes queued logs in batches until the queue is closed."""
+    while True:
+        logs = [_log_queue.get()]
+        # Take whatever else is already waiting, up to a full batch
+        while len(logs) < LOG_BATCH_SIZE and logs[-1] is not None:
+            try:
+                logs.append(_log_queue.get_nowait())
+            except queue.Empty:
+                break
+        closed = logs[-1] is None
+        if closed:
+            logs.pop()
+        if logs:
+            # Upload the batch's audio in parallel while the writes wait
+            for log in logs:
+                log.start_upload()
+            _write_batch(logs)
+        if closed:
+            return
+
+
+def _drain():
+    """Writes every queued log before the process exits."""
     try:
-        audio_name = upload_audio_file(
-            data.get("audio_data"))
-    except Exception:
-        audio_name = ""
-        err_msg = f"Failed to upload help response audio: {traceback.format_exc()}"
-        log_error(session_id, ERROR_TYPES.AUDIO_UPLOAD, err_msg)
+        _log_queue.put(None, timeout=LOG_DRAIN_TIMEOUT)
+    except queue.Full:
+        print_error(ERROR_TYPES.LOGGING, "Log queue did not drain before exit")
+        return
+    if _writer_thread is not None:
+        _writer_thread.join(timeout=LOG_DRAIN_TIMEOUT)
+    _upload_executor.shutdown(wait=False)
+
+
+def start_log_writer():
+    """Starts the background thread that writes queued logs."""
+    global _writer_thread
+    with _writer_lock:
+        if _writer_thread is None:
+            _writer_thread = threading.Thread(
+                target=_write_loop, name="log-writer", daemon=True)
+            _writer_thread.start()
+            atexit.register(_drain)
+
+
+def get_dropped_log_count():
+    """Returns how many logs have been dropped.
+
+    Logs are dropped when the queue is full, or when their batch could not
+    be written.
+
+    """
+    return _dropped_logs
+
+
+def _enqueue(log):
+    start_log_writer()
+    try:
+        if LOG_ENQUEUE_TIMEOUT > 0:
+            _log_queue.put(log, timeout=LOG_ENQUEUE_TIMEOUT)
+        else:
+            _log_queue.put_nowait(log)
+    except queue.Full:
+        dropped = _count_dropped(1)
+        print_error(
+            ERROR_TYPES.LOGGING,
+            f"Log queue is full, dropped a log ({dropped} dropped so far)")
+
+
+def _new_document(collection):
+    """Returns a reference to a new document, without any I/O."""
+    return get_client().collection(collection).document()
+
+
+def _get_linked_document(session_id):
+    """Returns the current user request document and its ID, if any."""
+    log_id = get_curr_log_id(session_id)
+    if not log_id:
+        return None, log_id
+    collection = get_client().collection(USER_REQUEST_LOGS_COLLECTION)
+    return collection.document(log_id), log_id
+
+
+def log_help_response(session_id, data):
     # Get errors from state_manager
     error_types, error_desc = get_curr_errors(session_id)
-    # Set all of the data in a log
-    try:
-        db = firestore.Client(project=PROJECT_ID)
-        doc_ref = db.collection(HELP_RESPONSE_LOGS_COLLECTION).document()
-        doc_ref.set({
+    _enqueue(PendingLog(
+        _new_document(HELP_RESPONSE_LOGS_COLLECTION),
+        {
             'session_id': session_id,
             'timestamp': datetime.now(),
             'help_type': data.get('help_type', ''),
             'text': data.get('text', ''),
-            'audio_name': audio_name,
-            'request_time_ms': compute_request_time(data.get('received_at', datetime.now()), data.get('response_at', datetime.now())),
-            'errors_occurred': len(error_types) > 0,
-            'error_types': error_types,
-            'error_desc': error_desc
-        })
-    except Exception:
-        err_msg = f"Error logging help response: {traceback.format_exc()}"
-        print_error(ERROR_TYPES.LOGGING, err_msg)
+            'request_time_ms': compute_request_time(data.get('received_at', datetime.now()), data.get('response_at', datetime.now()))
+        },
+        error_types,
+        error_desc,
+        audio_data=data.get("audio_data"),
+        audio_type=data.get("audio_type"),
+        audio_error="Failed to upload help response audio"
+    ))
 
 
 def log_andy_move(session_id, data):
@@ -175,32 +381,22 @@ def log_andy_move(session_id, data):
     """
     # Get errors from state_manager
     error_types, error_desc = get_curr_errors(session_id)
-    # Set all of the data in a log
-    try:
-        db = firestore.Client(project=PROJECT_ID)
-        log_id = get_curr_log_id(session_id)
-        doc_ref = db.collection(ANDY_MOVE_LOGS_COLLECTION).document()
-        doc_ref.set({
+    link_to, log_id = _get_linked_document(session_id)
+    _enqueue(PendingLog(
+        _new_document(ANDY_MOVE_LOGS_COLLECTION),
+        {
             'session_id': session_id,
             'timestamp': datetime.now(),
             'user_request_log_id': log_id,
             'move_info': data.get('move_info', {}),
             'board_str_before': data.get('board_str_before', ''),
             'board_str_after': data.get('board_str_after', ''),
-            'request_time_ms': compute_request_time(data.get('received_at', datetime.now()), data.get('response_at', datetime.now())),
-            'errors_occurred': len(error_types) > 0,
-            'error_types': error_types,
-            'error_desc': error_desc
-        })
-        # Link to the request log
-        req_doc_ref = db.collection(
-            USER_REQUEST_LOGS_COLLECTION).document(log_id)
-        req_doc_ref.set({
-            'linked_logs': [doc_ref]
-        }, merge=True)
-    except Exception:
-        err_msg = f"Error logging Andy's move: {traceback.format_exc()}"
-        print_error(ERROR_TYPES.LOGGING, err_msg)
+            'request_time_ms': compute_request_time(data.get('received_at', datetime.now()), data.get('response_at', datetime.now()))
+        },
+        error_types,
+        error_desc,
+        link_to=link_to
+    ))
 
 
 def log_andy_response(session_id, data):
@@ -214,45 +410,30 @@ def log_andy_response(session_id, data):
         {
             "text": str,
             "audio_data": bytes,
+            "audio_type": str,
             "received_at": datetime,
             "response_at": datetime,
         }
     """
-    # Upload audio_data and get name
-    try:
-        audio_name = upload_audio_file(
-            data.get("audio_data"))
-    except Exception:
-        audio_name = ""
-        err_msg = f"Failed to upload Andy's response audio: {traceback.format_exc()}"
-        log_error(session_id, ERROR_TYPES.AUDIO_UPLOAD, err_msg)
     # Get errors from state_manager
     error_types, error_desc = get_curr_errors(session_id)
-    # Set all of the data in a log
-    try:
-        db = firestore.Client(project=PROJECT_ID)
-        log_id = get_curr_log_id(session_id)
-        doc_ref = db.collection(ANDY_RESPONSE_LOGS_COLLECTION).document()
-        doc_ref.set({
+    link_to, log_id = _get_linked_document(session_id)
+    _enqueue(PendingLog(
+        _new_document(ANDY_RESPONSE_LOGS_COLLECTION),
+        {
             'session_id': session_id,
             'timestamp': datetime.now(),
             'user_request_log_id': log_id,
             'text': data.get('text', ''),
-            'audio_name': audio_name,
-            'request_time_ms': compute_request_time(data.get('received_at', datetime.now()), data.get('response_at', datetime.now())),
-            'errors_occurred': len(error_types) > 0,
-            'error_types': error_types,
-            'error_desc': error_desc
-        })
-        # Link to the request log
-        req_doc_ref = db.collection(
-            USER_REQUEST_LOGS_COLLECTION).document(log_id)
-        req_doc_ref.set({
-            'linked_logs': [doc_ref]
-        }, merge=True)
-    except Exception:
-        err_msg = f"Error logging Andy's response: {traceback.format_exc()}"
-        print_error(ERROR_TYPES.LOGGING, err_msg)
+            'request_time_ms': compute_request_time(data.get('received_at', datetime.now()), data.get('response_at', datetime.now()))
+        },
+        error_types,
+        error_desc,
+        audio_data=data.get("audio_data"),
+        audio_type=data.get("audio_type"),
+        audio_error="Failed to upload Andy's response audio",
+        link_to=link_to
+    ))
 
 
 def log_user_request(session_id, data):
@@ -266,6 +447,7 @@ def log_user_request(session_id, data):
         {
             "text": str,
             "audio_data": bytes,
+            "audio_type": str,
             "detected_intent": str,
             "detected_fulfillment": str,
             "fulfillment_success": bool,
@@ -276,27 +458,17 @@ def log_user_request(session_id, data):
             "recording_time_ms": float,
         }
     """
-    # Upload audio_data and get name
-    try:
-        audio_name = upload_audio_file(
-            data.get("audio_data"))
-    except Exception:
-        audio_name = ""
-        err_msg = f"Failed to upload user's request audio: {traceback.format_exc()}"
-        log_error(session_id, ERROR_TYPES.AUDIO_UPLOAD, err_msg)
     # Get errors from state_manager
     error_types, error_desc = get_curr_errors(session_id)
     # Get fulfillment params from state_manager
     fulfillment_params = get_fulfillment_params(session_id)
-    # Set all of the data in a log
-    try:
-        db = firestore.Client(project=PROJECT_ID)
-        doc_ref = db.collection(USER_REQUEST_LOGS_COLLECTION).document()
-        doc_ref.set({
+    doc_ref = _new_document(USER_REQUEST_LOGS_COLLECTION)
+    _enqueue(PendingLog(
+        doc_ref,
+        {
             'session_id': session_id,
             'timestamp': datetime.now(),
             'text': data.get('text', ''),
-            'audio_name': audio_name,
             'detected_intent': data.get('detected_intent', ''),
             'detected_fulfillment': data.get('detected_fulfillment', ''),
             'fulfillment_success': data.get('fulfillment_success', False),
@@ -304,14 +476,14 @@ def log_user_request(session_id, data):
             'board_str_before': data.get('board_str_before', ''),
             'board_str_after': data.get('board_str_after', ''),
             'request_time_ms': compute_request_time(data.get('received_at', datetime.now()), data.get('response_at', datetime.now())),
-            'errors_occurred': len(error_types) > 0,
-            'error_types': error_types,
-            'error_desc': error_desc,
             'linked_logs': [],
             'recording_time_ms': data.get('recording_time_ms', -1)
-        })
-        # Set the current log_id for linking other responses
-        set_curr_log_id(session_id, doc_ref.id)
-    except Exception:
-        err_msg = f"Error logging user's request: {traceback.format_exc()}"
-        print_error(ERROR_TYPES.LOGGING, err_msg)
+        },
+        error_types,
+        error_desc,
+        audio_data=data.get("audio_data"),
+        audio_type=data.get("audio_type"),
+        audio_error="Failed to upload user's request audio"
+    ))
+    # Set the current log_id for linking other responses
+    set_curr_log_id(session_id, doc_ref.id)
@@ -0,0 +1,71 @@
+"""Caches engine best moves by position, so repeated positions skip the search.
+
+Positions are keyed by their Zobrist hash along with the search settings, so
+the same position searched with different settings is cached separately.
+
+Attributes:
+    BEST_MOVE_CACHE_SIZE: the number of positions to keep, least recently
+        used first out.
+
+"""
+import os
+import threading
+from collections import OrderedDict
+
+import chess.polyglot
+
+BEST_MOVE_CACHE_SIZE = int(os.environ.get("BEST_MOVE_CACHE_SIZE", 4096))
+
+
+class MoveCache:
+    """A thread safe LRU cache of best moves, with hit and miss counters."""
+
+    def __init__(self, size):
+        self.size = size
+        self.hits = 0
+        self.misses = 0
+        self._moves = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(board, settings):
+        return chess.polyglot.zobrist_hash(board), settings
+
+    def get(self, key):
+        """Returns the cached move for a key, or None on a miss."""
+        with self._lock:
+            move = self._moves.get(key)
+            if move is None:
+                self.misses += 1
+                return None
+            self._moves.move_to_end(key)
+            self.hits += 1
+            return move
+
+    def put(self, key, move):
+        if self.size <= 0:
+            return
+        with self._lock:
+            self._moves[key] = move
+            self._moves.move_to_end(key)
+            while len(self._moves) > self.size:
+                self._moves.popitem(last=False)
+
+    def info(self):
+        """Returns the hit and miss counters and the current size."""
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "size": len(self._moves),
+                "max_size": self.size
+            }
+
+    def clear(self):
+        with self._lock:
+            self._moves.clear()
+            self.hits = 0
+            self.misses = 0
+
+
+best_move_cache = MoveCache(BEST_MOVE_CACHE_SIZE)
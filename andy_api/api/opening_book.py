@@ -0,0 +1,66 @@
+"""Looks up moves in a polyglot opening book before asking the engine.
+
+The book is only used if OPENING_BOOK_LOCATION is set. It is opened once and
+memory mapped, so lookups need no engine process or search time.
+
+Attributes:
+    OPENING_BOOK_LOCATION: the location of a polyglot .bin opening book.
+
+Book Selection:
+    "best": the entry with the highest weight.
+    "weighted": an entry chosen at random, weighted by the book's weights.
+    "uniform": any entry, chosen uniformly at random.
+
+"""
+import os
+import threading
+import traceback
+
+import chess.polyglot
+
+OPENING_BOOK_LOCATION = os.environ.get("OPENING_BOOK_LOCATION")
+
+_reader = None
+_reader_lock = threading.Lock()
+_reader_failed = False
+
+
+def get_reader():
+    """Returns the shared book reader, or None if there is no usable book."""
+    global _reader, _reader_failed
+    if not OPENING_BOOK_LOCATION or _reader_failed:
+        return None
+    with _reader_lock:
+        if _reader is None and not _reader_failed:
+            try:
+                _reader = chess.polyglot.open_reader(OPENING_BOOK_LOCATION)
+            except Exception:
+                print(
+                    f"Failed to open opening book: {traceback.format_exc()}")
+                _reader_failed = True
+        return _reader
+
+
+def get_book_move(board, selection="best"):
+    """Returns a book move for a board as a UCI string, or None if not in book.
+
+    Args:
+        board (chess.Board): the position to look up.
+        selection (str): how to choose between book moves (see the module
+            docstring).
+
+    """
+    reader = get_reader()
+    if reader is None:
+        return None
+    try:
+        if selection == "uniform":
+            entry = reader.choice(board)
+        elif selection == "weighted":
+            entry = reader.weighted_choice(board)
+        else:
+            entry = reader.find(board)
+    except IndexError:
+        # The position is not in the book
+        return None
+    return entry.move.uci()
@@ -0,0 +1,139 @@
+"""Thinks about Andy's replies while the user decides on their move.
+
+After Andy moves, a background ponder task finds the user's likely moves with
+a quick multi-PV search, then computes Andy's reply to each of them. When the
+user's move arrives, the task is cancelled and the reply for the resulting
+board is used if it was pondered, waiting for it if it is still being
+searched. Cancelling the task stops the engine's search in progress (UCI
+stop), so it gives back its engine and background slot right away.
+
+Attributes:
+    PONDER_CANDIDATES: the number of the user's likely moves to ponder.
+    PONDER_CANDIDATE_TIME_LIMIT: seconds spent finding the likely moves.
+
+"""
+import asyncio
+import os
+import threading
+import traceback
+from collections import OrderedDict
+
+import chess
+import chess.engine
+
+from .chess_logic import (
+    get_best_move_async,
+    get_candidate_moves_async,
+    get_difficulty_profile
+)
+from .engine_pool import get_loop
+from .precompute import PRECOMPUTE_MAX_SESSIONS
+
+PONDER_CANDIDATES = int(os.environ.get("PONDER_CANDIDATES", 3))
+PONDER_CANDIDATE_TIME_LIMIT = float(
+    os.environ.get("PONDER_CANDIDATE_TIME_LIMIT", 0.1))
+
+# PonderTask, keyed by session_id, oldest first
+_ponder_tasks = OrderedDict()
+_ponder_lock = threading.Lock()
+
+
+class PonderTask:
+    """Andy's pondered replies for one board, keyed by the board after the
+    user's move.
+
+    Each reply is an asyncio.Task on the engine loop, which may still be
+    running.
+
+    """
+
+    def __init__(self, board_str):
+        self.board_str = board_str
+        self.replies = {}
+        self.future = None
+
+    def stop(self, keep=None):
+        """Cancels the task and its searches, except the reply for keep."""
+        get_loop().call_soon_threadsafe(self._cancel, keep)
+
+    def _cancel(self, keep):
+        self.future.cancel()
+        for user_board_str, reply in self.replies.items():
+            if user_board_str != keep:
+                reply.cancel()
+
+    def report_failure(self, future):
+        if not future.cancelled() and future.exception() is not None:
+            error = future.exception()
+            print("Pondering failed: " + "".join(traceback.format_exception(
+                type(error), error, error.__traceback__)))
+
+    async def run(self, difficulty):
+        limit = chess.engine.Limit(time=PONDER_CANDIDATE_TIME_LIMIT)
+        candidates = await get_candidate_moves_async(
+            self.board_str, PONDER_CANDIDATES, limit)
+        board = chess.Board(self.board_str)
+        for move in candidates:
+            board.push_uci(move)
+            user_board_str = board.fen()
+            board.pop()
+            reply = asyncio.ensure_future(get_best_move_async(
+                user_board_str,
+                get_difficulty_profile(difficulty),
+                background=True
+            ))
+            self.replies[user_board_str] = reply
+            # Shielded, so cancelling the task can keep the reply it is on
+            await asyncio.shield(reply)
+
+
+def start_ponder(session_id, difficulty, board_str):
+    """Starts pondering Andy's replies to the user's moves from a board.
+
+    Args:
+        session_id: the unique session ID.
+        difficulty (str): the difficulty Andy plays at.
+        board_str: the state of the board after Andy's move, as text.
+
+    """
+    task = PonderTask(board_str)
+    task.future = asyncio.run_coroutine_threadsafe(
+        task.run(difficulty), get_loop())
+    task.future.add_done_callback(task.report_failure)
+    with _ponder_lock:
+        previous = _ponder_tasks.pop(session_id, None)
+        _ponder_tasks[session_id] = task
+        while len(_ponder_tasks) > PRECOMPUTE_MAX_SESSIONS:
+            _, oldest = _ponder_tasks.popitem(last=False)
+            oldest.stop()
+    if previous:
+        previous.stop()
+
+
+async def _wait_for_reply(reply):
+    # Shielded, so giving up on the reply does not cancel the engine's search
+    return await asyncio.shield(reply)
+
+
+def take_pondered_reply(session_id, board_str):
+    """Cancels a session's ponder task and takes its reply for a board.
+
+    Args:
+        session_id: the unique session ID.
+        board_str: the state of the board after the user's move, as text.
+
+    Returns:
+        coroutine: waits on the engine loop for Andy's pondered reply as UCI,
+            even if it is still being searched. None if the reply was never
+            started.
+
+    """
+    with _ponder_lock:
+        task = _ponder_tasks.pop(session_id, None)
+    if task is None:
+        return None
+    reply = task.replies.get(board_str)
+    task.stop(keep=board_str if reply is not None else None)
+    if reply is None:
+        return None
+    return _wait_for_reply(reply)
@@ -0,0 +1,133 @@
+"""Starts work for a session's next request before the request arrives.
+
+Results are keyed by session and FEN, so a result is only used if the board
+it was computed for is the board the later request sends. Coroutines run on
+the shared engine loop (see engine_pool), so pending work does not hold a
+thread. Results can be taken from a thread (take) or awaited from the app's
+event loop (take_async).
+
+Attributes:
+    PRECOMPUTE_MAX_SESSIONS: the number of sessions to keep results for,
+        oldest first out.
+
+"""
+import asyncio
+import os
+import threading
+import traceback
+from collections import OrderedDict
+from concurrent.futures import CancelledError, TimeoutError
+
+from .engine_pool import get_loop
+from .logging import log_error
+
+PRECOMPUTE_MAX_SESSIONS = int(
+    os.environ.get("PRECOMPUTE_MAX_SESSIONS", 1024))
+
+
+class PrecomputedResults:
+    """The latest precomputed result of one kind for each session.
+
+    Args:
+        name (str): what is computed, for error messages.
+        err_type (ERROR_TYPES): the type that failures are logged with.
+        max_sessions (int): the number of sessions to keep results for.
+
+    """
+
+    def __init__(self, name, err_type, max_sessions=PRECOMPUTE_MAX_SESSIONS):
+        self.name = name
+        self.err_type = err_type
+        self.max_sessions = max_sessions
+        # (board_str, concurrent.futures.Future), keyed by session_id
+        self._results = OrderedDict()
+        self._lock = threading.Lock()
+
+    def start(self, session_id, board_str, coro):
+        """Schedules a coroutine for a session's board, replacing older work."""
+        future = asyncio.run_coroutine_threadsafe(coro, get_loop())
+        with self._lock:
+            previous = self._results.pop(session_id, None)
+            self._results[session_id] = (board_str, future)
+            while len(self._results) > self.max_sessions:
+                _, (_, oldest) = self._results.popitem(last=False)
+                oldest.cancel()
+        if previous:
+            previous[1].cancel()
+
+    def _pop(self, session_id, board_str):
+        """Removes a session's work, returning its future if it was started
+        for this board. Work for another board is cancelled."""
+        with self._lock:
+            entry = self._results.pop(session_id, None)
+        if entry is None:
+            return None
+        started_board_str, future = entry
+        if started_board_str != board_str:
+            future.cancel()
+            return None
+        return future
+
+    def _failure_message(self):
+        """Describes the exception being handled as a failure of the work."""
+        return f"Precomputed {self.name} failed: {traceback.format_exc()}"
+
+    def _timeout_message(self):
+        return f"Precomputed {self.name} timed out"
+
+    def take(self, session_id, board_str, timeout=None):
+        """Returns the result for a session's board, waiting if in flight.
+
+        Failures and timeouts are logged as errors of the session.
+
+        Returns:
+            The result, or None if nothing was started for this board, or the
+            work failed or did not finish within the timeout.
+
+        """
+        future = self._pop(session_id, board_str)
+        if future is None:
+            return None
+        try:
+            return future.result(timeout=timeout)
+        except CancelledError:
+            return None
+        except TimeoutError:
+            future.cancel()
+            log_error(session_id, self.err_type, self._timeout_message())
+            return None
+        except Exception:
+            log_error(session_id, self.err_type, self._failure_message())
+            return None
+
+    async def take_async(self, session_id, board_str, timeout=None):
+        """Awaits the result for a session's board, see take.
+
+        Must be awaited on another event loop than the engine loop, such as
+        the app's. Errors are logged on a worker thread, since logging takes
+        the session's lock.
+
+        """
+        future = self._pop(session_id, board_str)
+        if future is None:
+            return None
+        waiter = asyncio.wrap_future(future)
+        try:
+            done, _ = await asyncio.wait({waiter}, timeout=timeout)
+        except asyncio.CancelledError:
+            # Nothing else will take the result
+            future.cancel()
+            raise
+        if not done:
+            future.cancel()
+            await asyncio.to_thread(
+                log_error, session_id, self.err_type, self._timeout_message())
+            return None
+        if waiter.cancelled():
+            return None
+        try:
+            return waiter.result()
+        except Exception:
+            err_msg = self._failure_message()
+        await asyncio.to_thread(log_error, session_id, self.err_type, err_msg)
+        return None
@@ -0,0 +1,98 @@
+"""Expires idle sessions and keeps the session store within a size budget.
+
+Attributes:
+    SESSION_TTL_SECONDS: sessions that have not been used for this long are
+        removed.
+    SESSION_STORE_BUDGET_BYTES: when the store is larger than this, finished
+        games are removed, least recently used first.
+    SWEEP_INTERVAL_SECONDS: how often the background sweeper runs.
+
+"""
+import os
+import threading
+import time
+import traceback
+
+from .state_manager import list_sessions, delete_session, get_backend, flush_all_sessions
+
+SESSION_TTL_SECONDS = float(
+    os.environ.get("SESSION_TTL_SECONDS", 24 * 60 * 60))
+SESSION_STORE_BUDGET_BYTES = int(
+    os.environ.get("SESSION_STORE_BUDGET_BYTES", 512 * 1024 * 1024))
+SWEEP_INTERVAL_SECONDS = float(
+    os.environ.get("SWEEP_INTERVAL_SECONDS", 10 * 60))
+
+_sweeper_thread = None
+
+
+def is_game_finished(session_id):
+    """Returns whether the session's game has finished, without caching it."""
+    return bool(get_backend().load(session_id).get("game_finished"))
+
+
+def sweep_sessions():
+    """Removes expired sessions, then evicts finished games over the budget.
+
+    Returns:
+        dict: a report of the sweep.
+
+        {
+            'sessions_removed': int,
+            'bytes_reclaimed': int,
+        }
+
+    """
+    # Make sure the store reflects the latest state before measuring it
+    flush_all_sessions()
+
+    backend = get_backend()
+    bytes_before = backend.disk_usage()
+    expires_before = time.time() - SESSION_TTL_SECONDS
+    sessions_removed = 0
+
+    # Remove idle sessions
+    remaining = []
+    for info in list_sessions():
+        if info.last_modified < expires_before:
+            # The session may have been used since it was listed
+            if delete_session(info.session_id, unused_since=expires_before):
+                sessions_removed += 1
+        else:
+            remaining.append(info)
+
+    # Evict finished games, least recently used first, until within budget
+    store_size = sum(info.size_bytes for info in remaining)
+    for info in sorted(remaining, key=lambda info: info.last_modified):
+        if store_size <= SESSION_STORE_BUDGET_BYTES:
+            break
+        if is_game_finished(info.session_id) and delete_session(
+                info.session_id, unused_since=info.last_modified):
+            sessions_removed += 1
+            store_size -= info.size_bytes
+
+    if sessions_removed > 0:
+        backend.compact()
+
+    return {
+        'sessions_removed': sessions_removed,
+        'bytes_reclaimed': max(bytes_before - backend.disk_usage(), 0)
+    }
+
+
+def _sweep_loop():
+    while True:
+        time.sleep(SWEEP_INTERVAL_SECONDS)
+        try:
+            report = sweep_sessions()
+            print(
+                f"Session sweep removed {report['sessions_removed']} sessions, reclaimed {report['bytes_reclaimed']} bytes")
+        except Exception:
+            print(f"Session sweep failed: {traceback.format_exc()}")
+
+
+def start_sweeper():
+    """Starts the background thread that periodically sweeps sessions."""
+    global _sweeper_thread
+    if _sweeper_thread is None:
+        _sweeper_thread = threading.Thread(target=_sweep_loop, daemon=True)
+        _sweeper_thread.start()
@@ -1,16 +1,33 @@
 """This module handles the processing of audio files.
 
+Text-to-speech requests are made with the async client on the app's event
+loop, so requests in flight share one gRPC channel and do not each hold a
+thread.
+
 Attributes:
     BUCKET_NAME: the name of the bucket to upload user's audio to for STT.
     FILENAME_PREFIX: the directory in the bucket to store audio files for STT.
-    FILE_TYPE: the type of the file to be processed for STT.
+    FILE_TYPE: the type of the file to be processed for STT, and the default
+        type of uploaded audio.
     BOARD_LOCATION_CC: the name of the BoardLocation custom class for
         STT.
     FILE_SAMPLE_RATE: the sample rate of the file to be processed for STT.
     OUTPUT_FILE_NAME: the name of the file to output for TTS.
+    TTS_STREAM_PREFETCH: the number of sentences synthesized at once when
+        streaming audio, so later sentences are ready as earlier ones play.
+    AUDIO_FORMATS: the TTS encoding and content type of each audio format
+        clients can ask for, by name.
+    DEFAULT_AUDIO_FORMAT: the audio format used if the client does not ask
+        for one.
 
 """
+import asyncio
+import io
+import os
+import re
 import uuid
+import wave
+from collections import deque, namedtuple
 from google.cloud import speech_v1p1beta1 as speech, storage, texttospeech
 
 BUCKET_NAME = "chess-to-speech"
@@ -19,13 +36,30 @@ FILE_TYPE = "audio/wav"
 MOVE_PIECE_PHRASE_SET = "projects/408609438071/locations/global/phraseSets/MovePiece"
 FILE_SAMPLE_RATE = 48000
 OUTPUT_FILE_NAME = "andy_response.wav"
+TTS_STREAM_PREFETCH = int(os.environ.get("TTS_STREAM_PREFETCH", 2))
+
+AudioFormat = namedtuple("AudioFormat", ["encoding", "mimetype"])
+
+AUDIO_FORMATS = {
+    "wav": AudioFormat(texttospeech.AudioEncoding.LINEAR16, "audio/wav"),
+    "mp3": AudioFormat(texttospeech.AudioEncoding.MP3, "audio/mpeg"),
+    "ogg_opus": AudioFormat(texttospeech.AudioEncoding.OGG_OPUS, "audio/ogg")
+}
+DEFAULT_AUDIO_FORMAT = "wav"
+
+# Whitespace after the end of a sentence
+SENTENCE_BOUNDARY = re.compile(r"(?<=[.!?])\s+")
 
+# Created on the app's event loop on first use
+_tts_client = None
 
-def upload_audio_file(file_to_upload):
+
+def upload_audio_file(file_to_upload, content_type=FILE_TYPE):
     """Uploads an audio file to gcloud storage.
 
     Args:
         file_to_upload (blob): the blob to upload.
+        content_type (str): the type of the audio, such as "audio/flac".
 
     Returns:
         str: the name of the file uploaded.
@@ -37,26 +71,39 @@ def upload_audio_file(file_to_upload):
         blob_name = FILENAME_PREFIX + str(uuid.uuid4())
         blob = bucket.blob(blob_name)
 
-        blob.upload_from_string(file_to_upload, content_type=FILE_TYPE)
+        blob.upload_from_string(file_to_upload, content_type=content_type)
 
         return blob_name
     except Exception as e:
         raise
 
 
-def generate_audio_response(text):
+def _get_tts_client():
+    """Returns the shared async TTS client. Must be called on the app's
+    event loop, which the client's channel is bound to."""
+    global _tts_client
+    if _tts_client is None:
+        _tts_client = texttospeech.TextToSpeechAsyncClient()
+    return _tts_client
+
+
+async def generate_audio_response_async(text,
+                                        audio_format=DEFAULT_AUDIO_FORMAT):
     """Converts text into an audio file.
 
+    Must be awaited on the app's event loop.
+
     Args:
         text (str): the text to transform into audio.
+        audio_format (str): the name of the format to return (see
+            AUDIO_FORMATS).
 
     Returns:
         bytes: the audio bytes generated.
 
     """
     try:
-        # Instantiates a client
-        client = texttospeech.TextToSpeechClient()
+        client = _get_tts_client()
 
         # Set the text input to be synthesized
         synthesis_input = texttospeech.SynthesisInput(text=text)
@@ -69,12 +116,12 @@ def generate_audio_response(text):
 
         # Select the type of audio file you want returned
         audio_config = texttospeech.AudioConfig(
-            audio_encoding=texttospeech.AudioEncoding.LINEAR16
+            audio_encoding=AUDIO_FORMATS[audio_format].encoding
         )
 
         # Perform the text-to-speech request on the text input with the selected
         # voice parameters and audio file type
-        response = client.synthesize_speech(
+        response = await client.synthesize_speech(
             input=synthesis_input, voice=voice, audio_config=audio_config
         )
 
@@ -83,6 +130,81 @@ def generate_audio_response(text):
         raise
 
 
+def split_sentences(text):
+    """Splits text into its sentences, keeping their punctuation."""
+    return [
+        sentence for sentence in SENTENCE_BOUNDARY.split(text.strip())
+        if sentence
+    ]
+
+
+async def generate_audio_stream(text, audio_format=DEFAULT_AUDIO_FORMAT):
+    """Converts text into audio one sentence at a time.
+
+    Sentences are synthesized ahead of the one being yielded, up to
+    TTS_STREAM_PREFETCH at once, so the first sentence can be played while
+    the rest are synthesized. Must be iterated on the app's event loop.
+
+    Args:
+        text (str): the text to transform into audio.
+        audio_format (str): the name of the format to return (see
+            AUDIO_FORMATS).
+
+    Yields:
+        bytes: the audio file of each sentence, in order.
+
+    """
+    sentences = iter(split_sentences(text) or [text])
+    pending = deque()
+    try:
+        for sentence in sentences:
+            pending.append(asyncio.ensure_future(
+                generate_audio_response_async(sentence, audio_format)))
+            if len(pending) >= TTS_STREAM_PREFETCH:
+                break
+        while pending:
+            audio = await pending.popleft()
+            sentence = next(sentences, None)
+            if sentence is not None:
+                pending.append(asyncio.ensure_future(
+                    generate_audio_response_async(sentence, audio_format)))
+            yield audio
+    finally:
+        # Stop synthesizing if the stream was abandoned or failed
+        for task in pending:
+            task.cancel()
+
+
+def join_audio_clips(clips, audio_format=DEFAULT_AUDIO_FORMAT):
+    """Joins audio clips with the same format into one audio file.
+
+    MP3 frames and Ogg streams can simply be chained, while WAV clips are
+    rewritten with a single header.
+
+    Args:
+        clips (list): the bytes of each audio clip, in order.
+        audio_format (str): the name of the clips' format (see
+            AUDIO_FORMATS).
+
+    Returns:
+        bytes: the joined audio file, or empty bytes if there are no clips.
+
+    """
+    if not clips:
+        return b""
+    if audio_format != "wav":
+        return b"".join(clips)
+    joined = io.BytesIO()
+    with wave.open(joined, "wb") as joined_wav:
+        for index, clip in enumerate(clips):
+            with wave.open(io.BytesIO(clip), "rb") as clip_wav:
+                if index == 0:
+                    joined_wav.setparams(clip_wav.getparams())
+                joined_wav.writeframes(
+                    clip_wav.readframes(clip_wav.getnframes()))
+    return joined.getvalue()
+
+
 # def transcribe_audio_file(file_to_transcribe):
 #     """Converts an audio file into text.
 
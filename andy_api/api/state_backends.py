@@ -0,0 +1,292 @@
+"""Storage backends for the session state managed by state_manager.
+
+A session's state is a flat dictionary of keys to picklable values. Backends
+only need to load all of the keys of a session and save a subset of them.
+
+Attributes:
+    STATE_BACKEND: the backend to use, one of "shelve" | "sqlite".
+    STATE_DATABASE: the location of the SQLite database file.
+
+"""
+import dbm
+import os
+import pickle
+import shelve
+import sqlite3
+import threading
+import time
+from collections import namedtuple
+from pathlib import Path
+
+try:
+    import fcntl
+except ImportError:
+    # File locks are not available on Windows, only in-process locks are used
+    fcntl = None
+
+STATE_BACKEND = os.environ.get("STATE_BACKEND", "shelve")
+STATE_DATABASE = os.environ.get("STATE_DATABASE", "./state.db")
+
+# Seconds to wait on a locked SQLite database before failing
+SQLITE_BUSY_TIMEOUT = 30
+
+# Summary of a stored session, used for expiry and eviction
+SessionInfo = namedtuple(
+    "SessionInfo", ["session_id", "last_modified", "size_bytes"])
+
+
+class FileLock:
+    """An exclusive advisory lock on a file, shared by every process."""
+
+    def __init__(self, path):
+        self.path = path
+        self._file = None
+
+    def acquire(self):
+        if fcntl is None:
+            return
+        self._file = open(self.path, "a")
+        fcntl.flock(self._file.fileno(), fcntl.LOCK_EX)
+
+    def release(self):
+        if self._file is not None:
+            fcntl.flock(self._file.fileno(), fcntl.LOCK_UN)
+            self._file.close()
+            self._file = None
+
+
+class NoLock:
+    """A lock that does nothing, for backends used by a single process."""
+
+    def acquire(self):
+        pass
+
+    def release(self):
+        pass
+
+
+class StateBackend:
+    """Interface for persisting the state of sessions.
+
+    Attributes:
+        shared (bool): whether several processes can safely use the store at
+            the same time. Cached state is not kept across requests for
+            shared backends, since another worker may change it.
+
+    """
+    shared = False
+
+    def load(self, session_id):
+        """Returns every key of a session's state as a dict."""
+        raise NotImplementedError
+
+    def get_lock(self, session_id):
+        """Returns a lock that serializes access to a session across processes."""
+        return NoLock()
+
+    def save(self, session_id, values):
+        """Writes the given keys of a session's state."""
+        raise NotImplementedError
+
+    def last_modified(self, session_id):
+        """Returns when a session was last written, or None if it is not stored."""
+        raise NotImplementedError
+
+    def list_sessions(self):
+        """Returns a SessionInfo for every stored session."""
+        raise NotImplementedError
+
+    def delete(self, session_id):
+        """Removes all of a session's state."""
+        raise NotImplementedError
+
+    def compact(self):
+        """Gives space freed by deleted sessions back to the filesystem."""
+
+    def disk_usage(self):
+        """Returns the number of bytes the store uses on disk."""
+        raise NotImplementedError
+
+
+class ShelveBackend(StateBackend):
+    """Stores each session in its own shelve file.
+
+    Shelve files are not safe to open from several processes at once, so
+    this backend should only be used with a single API process. Sessions
+    are only locked within that process.
+
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+
+    def get_shelve_file(self, session_id):
+        """Returns the name of the shelve file location."""
+        return f"{self.directory}/{session_id}"
+
+    def load(self, session_id):
+        path = self.get_shelve_file(session_id)
+        # Loading a session that is not stored should not create its file
+        if dbm.whichdb(path) is None:
+            return {}
+        with shelve.open(path, flag="r") as db:
+            return dict(db)
+
+    def save(self, session_id, values):
+        with shelve.open(self.get_shelve_file(session_id)) as db:
+            for key, value in values.items():
+                db[key] = value
+
+    def last_modified(self, session_id):
+        paths = [
+            path for path in Path(self.directory).glob(f"{session_id}*")
+            if path.name.split(".", 1)[0] == session_id
+        ]
+        if not paths:
+            return None
+        return max(path.stat().st_mtime for path in paths)
+
+    def _session_files(self):
+        """Groups the files in the directory by session_id.
+
+        Depending on the dbm implementation, a shelve is stored as one or
+        more files that share the session_id as a prefix (e.g. .dat, .dir).
+
+        """
+        files = {}
+        for path in Path(self.directory).iterdir():
+            session_id = path.name.split(".", 1)[0]
+            files.setdefault(session_id, []).append(path)
+        return files
+
+    def list_sessions(self):
+        sessions = []
+        for session_id, paths in self._session_files().items():
+            stats = [path.stat() for path in paths]
+            sessions.append(SessionInfo(
+                session_id=session_id,
+                last_modified=max(stat.st_mtime for stat in stats),
+                size_bytes=sum(stat.st_size for stat in stats)
+            ))
+        return sessions
+
+    def delete(self, session_id):
+        for path in Path(self.directory).glob(f"{session_id}*"):
+            if path.name.split(".", 1)[0] == session_id:
+                path.unlink(missing_ok=True)
+
+    def disk_usage(self):
+        return sum(
+            path.stat().st_size for path in Path(self.directory).iterdir())
+
+
+class SQLiteBackend(StateBackend):
+    """Stores every session in a single SQLite table running in WAL mode.
+
+    WAL mode lets readers proceed while another worker writes. Each thread of
+    each worker process keeps its own connection, and sqlite3 keeps the
+    compiled (prepared) statements cached on that connection.
+
+    """
+    shared = True
+
+    CREATE_TABLE = """
+        CREATE TABLE IF NOT EXISTS session_state (
+            session_id TEXT NOT NULL,
+            key TEXT NOT NULL,
+            value BLOB,
+            updated_at REAL NOT NULL,
+            PRIMARY KEY (session_id, key)
+        ) WITHOUT ROWID
+    """
+    SELECT_SESSION = "SELECT key, value FROM session_state WHERE session_id = ?"
+    UPSERT_KEY = """
+        INSERT OR REPLACE INTO session_state (session_id, key, value, updated_at)
+        VALUES (?, ?, ?, ?)
+    """
+    LIST_SESSIONS = """
+        SELECT session_id, MAX(updated_at), SUM(LENGTH(key) + LENGTH(value))
+        FROM session_state
+        GROUP BY session_id
+    """
+    LAST_MODIFIED = "SELECT MAX(updated_at) FROM session_state WHERE session_id = ?"
+    DELETE_SESSION = "DELETE FROM session_state WHERE session_id = ?"
+
+    def __init__(self, path):
+        self.path = path
+        self.lock_directory = f"{path}.locks"
+        self._local = threading.local()
+        Path(self.lock_directory).mkdir(parents=True, exist_ok=True)
+
+    def _connection(self):
+        """Returns the connection for the current thread and process."""
+        conn = getattr(self._local, "conn", None)
+        # Connections cannot be shared with a forked worker process
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(
+                self.path,
+                timeout=SQLITE_BUSY_TIMEOUT,
+                isolation_level=None
+            )
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(self.CREATE_TABLE)
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def get_lock(self, session_id):
+        # SQLite only locks the whole database, so each session's rows are
+        # guarded by a lock file instead
+        return FileLock(f"{self.lock_directory}/{session_id}")
+
+    def load(self, session_id):
+        rows = self._connection().execute(self.SELECT_SESSION, (session_id,))
+        return {key: pickle.loads(value) for key, value in rows}
+
+    def save(self, session_id, values):
+        conn = self._connection()
+        updated_at = time.time()
+        rows = [
+            (session_id, key, pickle.dumps(value), updated_at)
+            for key, value in values.items()
+        ]
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.executemany(self.UPSERT_KEY, rows)
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+
+    def last_modified(self, session_id):
+        row = self._connection().execute(
+            self.LAST_MODIFIED, (session_id,)).fetchone()
+        return row[0]
+
+    def list_sessions(self):
+        rows = self._connection().execute(self.LIST_SESSIONS)
+        return [SessionInfo(*row) for row in rows]
+
+    def delete(self, session_id):
+        self._connection().execute(self.DELETE_SESSION, (session_id,))
+        Path(f"{self.lock_directory}/{session_id}").unlink(missing_ok=True)
+
+    def compact(self):
+        conn = self._connection()
+        conn.execute("VACUUM")
+        conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+
+    def disk_usage(self):
+        paths = [Path(self.path + suffix) for suffix in ["", "-wal", "-shm"]]
+        return sum(path.stat().st_size for path in paths if path.exists())
+
+
+def create_backend(shelve_directory):
+    """Creates the backend selected by STATE_BACKEND."""
+    if STATE_BACKEND == "sqlite":
+        return SQLiteBackend(STATE_DATABASE)
+    elif STATE_BACKEND == "shelve":
+        return ShelveBackend(shelve_directory)
+    else:
+        raise Exception(f"Unknown state backend: {STATE_BACKEND}")
@@ -1,6 +1,31 @@
 """Manages the state for the API (session handling).
 
-The filename of shelve shall correspond to the unique session_id.
+The state is persisted by the backend selected in state_backends (shelve by
+default). When using shelve, the filename shall correspond to the unique
+session_id.
+
+Each session's state is read from the backend once and then kept in a
+process-local cache. Setters only update the cache and mark the changed keys
+as dirty. For backends used by a single process (shelve), requests do not
+write to disk: a background write-behind thread writes every dirty session
+each WRITE_BEHIND_INTERVAL seconds, and once more when the process exits, so
+several requests' changes to a session go out in one write. A crash loses
+at most the changes of the last interval. For backends shared between
+several worker processes, a session is flushed when its lock is released and
+then dropped from the cache, so the next request, in any worker, reads fresh
+state.
+
+Operations that change a session are serialized with a per-session lock (see
+session_lock). Requests and log writes for the same session wait for each
+other in arrival order, while different sessions proceed in parallel. A lock
+is held by its owner: the thread that took it, or the request that set a
+lock owner with new_lock_owner. Request handlers on an event loop share one
+thread, so each request takes its session's lock as its own owner, and
+tasks and threads started for the request (asyncio.to_thread) inherit it.
+Taking a lock can block, so it is never done on an event loop thread, only
+on worker threads. For shared backends, the lock is also held across
+processes through the backend. Reads and writes to the backend happen under the session's lock only; the process-wide
+_cache_lock just guards the cache dictionaries.
 
 Game State Dict:
     {
@@ -11,58 +36,386 @@ Game State Dict:
         "game_started": bool | None,
         "chosen_side": str | None,
         "game_finished": bool | None,
-        "board_stack": [] | None,
         "difficulty_selection": str | None,
         "gave_initial_possible_actions": bool | None,
+        "move_log_start": str | None,
+        "move_log_fen": str | None,
+        "move_count": int,
+        "move_log": str,
     }
 
+Move Log:
+    The moves of a game are stored as a log of UCI moves played from
+    move_log_start, in a single move_log string. Each move is followed by a
+    space and prefixed with "u:" if the user made it or "a:" if Andy did,
+    e.g. "u:e2e4 a:e7e5 ". Recording a move appends to it and updates
+    move_count and move_log_fen (the FEN after the last logged move), rather
+    than storing a FEN per move. A string is written as one record and is
+    not copied element by element when read. Undoing a move truncates the
+    log, so no stale entries are kept. Boards are only rebuilt from the log
+    when a move is undone.
+
 """
-import shelve
+import asyncio
+import atexit
+import contextvars
+import os
+import threading
+import time
+import weakref
+from collections import deque
+from copy import deepcopy
+
+import chess
+
+from .state_backends import create_backend
 
 SHELVE_DIRECTORY = "./shelve"
+# Seconds between background flushes of dirty session state to disk
+WRITE_BEHIND_INTERVAL = float(os.environ.get("STATE_WRITE_BEHIND_INTERVAL", 5))
+
+# Process-local cache of each session's state dict, keyed by session_id
+_session_cache = {}
+# Keys that have been changed in memory but not yet written to disk
+_dirty_keys = {}
+# Time each cached session was last used, in seconds since the epoch
+_last_access = {}
+_cache_lock = threading.RLock()
+# Per-session locks, keyed by session_id. A lock is dropped once nothing
+# holds, waits on or is about to take it, so deleted sessions leave no lock
+_session_locks = weakref.WeakValueDictionary()
+# The owner of the session locks taken in this context, see new_lock_owner
+_lock_owner = contextvars.ContextVar("session_lock_owner", default=None)
+_write_behind_thread = None
+_backend = create_backend(SHELVE_DIRECTORY)
+
+
+def _load_session(session_id):
+    """Returns the cached state dict for a session, reading it from disk once.
+
+    The backend is read without holding _cache_lock, so that loading one
+    session does not hold up the others. Callers should hold the session's
+    lock, so the session is not loaded twice at the same time.
+
+    """
+    with _cache_lock:
+        values = _session_cache.get(session_id)
+        if values is not None:
+            _last_access[session_id] = time.time()
+            return values
+    loaded = _backend.load(session_id)
+    with _cache_lock:
+        values = _session_cache.setdefault(session_id, loaded)
+        _last_access[session_id] = time.time()
+        return values
+
+
+def _get_value(session_id, key, default=None):
+    """Gets a single value from the cached session state."""
+    values = _load_session(session_id)
+    with _cache_lock:
+        return deepcopy(values.get(key, default))
+
+
+def _set_values(session_id, values):
+    """Updates the cached session state and marks the keys as dirty."""
+    cached = _load_session(session_id)
+    with _cache_lock:
+        cached.update(deepcopy(values))
+        _dirty_keys.setdefault(session_id, set()).update(values)
+
+
+def _flush_session_locked(session_id):
+    """Writes the dirty keys of a session to the backend in a single write.
+
+    Must be called while holding the session's lock. Cached values are only
+    ever replaced, never changed in place, so they can be written after
+    _cache_lock is released.
+
+    """
+    with _cache_lock:
+        keys = _dirty_keys.pop(session_id, None)
+        if keys:
+            cached = _session_cache[session_id]
+            values = {key: cached[key] for key in keys}
+    if keys:
+        try:
+            _backend.save(session_id, values)
+        except Exception:
+            # Keep the keys dirty so the next flush writes them
+            with _cache_lock:
+                _dirty_keys.setdefault(session_id, set()).update(keys)
+            raise
+    if _backend.shared:
+        with _cache_lock:
+            _session_cache.pop(session_id, None)
+            _last_access.pop(session_id, None)
+
+
+def load_session(session_id):
+    """Reads a session into the cache, if it is not already cached.
+
+    Should be called while holding the session's lock.
+
+    """
+    _load_session(session_id)
+
+
+def flush_session(session_id):
+    """Writes the dirty keys of a session to the backend in a single write."""
+    with session_lock(session_id):
+        _flush_session_locked(session_id)
+
+
+def new_lock_owner():
+    """Makes the current context the owner of the session locks it takes.
+
+    Locks are otherwise owned by the thread that takes them. Tasks and
+    threads started from this context with a copy of it (such as
+    asyncio.to_thread) share the owner, so they can take the same locks
+    again.
+
+    """
+    _lock_owner.set(object())
+
+
+def _get_lock_owner():
+    """Returns the owner of locks taken now: the context's or the thread."""
+    owner = _lock_owner.get()
+    if owner is None:
+        return threading.get_ident()
+    return owner
+
+
+def _check_not_on_event_loop():
+    """Raises if called on a thread running an event loop.
+
+    Waiting for a session lock blocks the thread. On an event loop thread,
+    that would stall every request, so locks are taken on a worker thread
+    instead (asyncio.to_thread).
+
+    """
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return
+    raise RuntimeError(
+        "Session locks must not be taken on an event loop thread")
+
+
+class SessionLock:
+    """A reentrant lock on one session, granted in the order it was requested.
+
+    The outermost acquire also takes the backend's cross-process lock for the
+    session. For shared backends, the session is flushed before that lock is
+    released so the next holder sees every change.
+
+    """
+
+    def __init__(self, session_id):
+        self.session_id = session_id
+        self._condition = threading.Condition()
+        self._waiting = deque()
+        self._owner = None
+        self._depth = 0
+        self._backend_lock = None
+
+    def acquire(self):
+        _check_not_on_event_loop()
+        owner = _get_lock_owner()
+        with self._condition:
+            if self._owner == owner:
+                self._depth += 1
+                return
+            self._waiting.append(owner)
+            while self._owner is not None or self._waiting[0] != owner:
+                self._condition.wait()
+            self._waiting.popleft()
+            self._owner = owner
+            self._depth = 1
+        self._backend_lock = _backend.get_lock(self.session_id)
+        self._backend_lock.acquire()
+        if _backend.shared:
+            # Another worker may have changed the session since it was cached
+            with _cache_lock:
+                if self.session_id not in _dirty_keys:
+                    _session_cache.pop(self.session_id, None)
+
+    def release(self):
+        with self._condition:
+            self._depth -= 1
+            if self._depth > 0:
+                return
+        try:
+            if _backend.shared:
+                _flush_session_locked(self.session_id)
+        finally:
+            self._backend_lock.release()
+            self._backend_lock = None
+            with self._condition:
+                self._owner = None
+                self._condition.notify_all()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.release()
+
+
+def session_lock(session_id):
+    """Returns the lock that serializes changes to a session."""
+    with _cache_lock:
+        lock = _session_locks.get(session_id)
+        if lock is None:
+            lock = SessionLock(session_id)
+            _session_locks[session_id] = lock
+        return lock
+
+
+def list_sessions():
+    """Returns a SessionInfo for every stored session.
+
+    The last_modified time also accounts for sessions that have only been
+    used through the cache since they were last written.
+
+    """
+    sessions = _backend.list_sessions()
+    with _cache_lock:
+        return [
+            info._replace(last_modified=max(
+                info.last_modified,
+                _last_access.get(info.session_id, 0)
+            ))
+            for info in sessions
+        ]
+
+
+def delete_session(session_id, unused_since=None):
+    """Removes a session from the cache and the backend.
+
+    The session's lock is dropped once no request holds or waits on it (see
+    _session_locks).
+
+    Args:
+        session_id (str): the session to remove.
+        unused_since (float | None): if given, the session is only removed if
+            it has not been used after this time, checked under the session's
+            lock.
+
+    Returns:
+        bool: whether the session was removed.
+
+    """
+    with session_lock(session_id):
+        if unused_since is not None:
+            with _cache_lock:
+                last_access = _last_access.get(session_id, 0)
+            last_modified = _backend.last_modified(session_id) or 0
+            if max(last_access, last_modified) > unused_since:
+                return False
+        with _cache_lock:
+            _session_cache.pop(session_id, None)
+            _dirty_keys.pop(session_id, None)
+            _last_access.pop(session_id, None)
+        _backend.delete(session_id)
+        return True
+
+
+def get_backend():
+    """Returns the backend that session state is persisted with."""
+    return _backend
+
+
+def set_backend(backend):
+    """Persists session state with a different backend from now on.
+
+    Pending changes are written to the current backend first.
+
+    """
+    global _backend
+    flush_all_sessions()
+    with _cache_lock:
+        _session_cache.clear()
+        _last_access.clear()
+        _backend = backend
+
+
+def flush_all_sessions():
+    """Writes the dirty keys of every cached session to disk.
+
+    Each session is flushed under its lock, so a session is not written while
+    a request is changing it.
+
+    """
+    with _cache_lock:
+        session_ids = list(_dirty_keys)
+    for session_id in session_ids:
+        flush_session(session_id)
+
+
+def _write_behind_loop():
+    while True:
+        time.sleep(WRITE_BEHIND_INTERVAL)
+        try:
+            flush_all_sessions()
+        except Exception as err:
+            print(f"Failed to flush session state: {err}")
+
+
+def start_write_behind():
+    """Starts the background thread that periodically flushes session state."""
+    global _write_behind_thread
+    if _write_behind_thread is None:
+        _write_behind_thread = threading.Thread(
+            target=_write_behind_loop, daemon=True)
+        _write_behind_thread.start()
+        atexit.register(flush_all_sessions)
 
 
 def get_fulfillment_params(session_id):
     """Get the fulfillment params."""
-    with shelve.open(get_shelve_file(session_id)) as db:
-        params = db.get("fulfillment_params", {})
-        return params
+    return _get_value(session_id, "fulfillment_params", {})
 
 
 def set_fulfillment_params(session_id, params):
     """Set the fulfillment params."""
-    with shelve.open(get_shelve_file(session_id)) as db:
-        db["fulfillment_params"] = params
+    _set_values(session_id, {"fulfillment_params": params})
 
 
 def get_curr_errors(session_id):
     """Gets the list of current errors."""
-    with shelve.open(get_shelve_file(session_id)) as db:
+    with session_lock(session_id):
         # Get current list
-        err_types = db.get("curr_err_type", [])
-        err_descs = db.get("curr_err_desc", [])
+        err_types = _get_value(session_id, "curr_err_type", [])
+        err_descs = _get_value(session_id, "curr_err_desc", [])
 
         # Reset list of errors
-        db["curr_err_type"] = []
-        db["curr_err_desc"] = []
+        _set_values(session_id, {
+            "curr_err_type": [],
+            "curr_err_desc": []
+        })
 
         return err_types, err_descs
 
 
 def set_curr_errors(session_id, err_type, err_desc):
     """Stores the error in the list of current errors."""
-    with shelve.open(get_shelve_file(session_id)) as db:
+    with session_lock(session_id):
         # Get current list
-        err_types = db.get("curr_err_type", [])
-        err_descs = db.get("curr_err_desc", [])
+        err_types = _get_value(session_id, "curr_err_type", [])
+        err_descs = _get_value(session_id, "curr_err_desc", [])
 
         # Update list
         err_types.append(err_type)
         err_descs.append(err_desc)
 
-        # Update list in shelve
-        db["curr_err_type"] = err_types
-        db["curr_err_desc"] = err_descs
+        # Update list in cache
+        _set_values(session_id, {
+            "curr_err_type": err_types,
+            "curr_err_desc": err_descs
+        })
 
 
 def get_shelve_file(session_id):
@@ -72,14 +425,12 @@ def get_shelve_file(session_id):
 
 def set_curr_log_id(session_id, log_id):
     """Sets the current log_id for a session."""
-    with shelve.open(get_shelve_file(session_id)) as db:
-        db['curr_log_id'] = log_id
+    _set_values(session_id, {"curr_log_id": log_id})
 
 
 def get_curr_log_id(session_id):
     """Gets the current log_id for a session."""
-    with shelve.open(get_shelve_file(session_id)) as db:
-        return db.get('curr_log_id')
+    return _get_value(session_id, "curr_log_id")
 
 
 def get_game_state(session_id):
@@ -90,75 +441,211 @@ def get_game_state(session_id):
             "game_started": bool | None,
             "chosen_side": str | None,
             "game_finished": bool | None,
-            "board_stack": [] | None,
             "difficulty_selection": str | None,
             "gave_initial_possible_actions": bool | None,
+            "move_count": int,
         }
 
     """
-    with shelve.open(get_shelve_file(session_id)) as db:
+    values = _load_session(session_id)
+    with _cache_lock:
         game_state = {
-            "game_started": db.get("game_started"),
-            "chosen_side": db.get("chosen_side"),
-            "game_finished": db.get("game_finished"),
-            "board_stack": db.get("board_stack"),
-            "difficulty_selection": db.get("difficulty_selection"),
-            "gave_initial_possible_actions": db.get("gave_initial_possible_actions")
+            "game_started": values.get("game_started"),
+            "chosen_side": values.get("chosen_side"),
+            "game_finished": values.get("game_finished"),
+            "difficulty_selection": values.get("difficulty_selection"),
+            "gave_initial_possible_actions": values.get("gave_initial_possible_actions"),
+            "move_count": values.get("move_count", 0)
         }
         return game_state
 
 
 def set_gave_initial_possible_actions(session_id):
     """Sets gave_initial_possible_actions to True."""
-    with shelve.open(get_shelve_file(session_id)) as db:
-        db["gave_initial_possible_actions"] = True
+    _set_values(session_id, {"gave_initial_possible_actions": True})
 
 
 def set_game_started(session_id):
     """Sets game_started to True."""
-    with shelve.open(get_shelve_file(session_id)) as db:
-        db["game_started"] = True
+    _set_values(session_id, {"game_started": True})
 
 
 def set_chosen_side(session_id, val):
     """Sets chosen_side to a new value."""
-    with shelve.open(get_shelve_file(session_id)) as db:
-        db["chosen_side"] = val
+    _set_values(session_id, {"chosen_side": val})
 
 
 def set_difficulty_selection(session_id, val):
     """Sets difficulty_selection to a new value"""
-    with shelve.open(get_shelve_file(session_id)) as db:
-        db["difficulty_selection"] = val
+    _set_values(session_id, {"difficulty_selection": val})
 
 
 def set_game_finished(session_id):
     """Sets game_finished to True."""
-    with shelve.open(get_shelve_file(session_id)) as db:
-        db["game_finished"] = True
+    _set_values(session_id, {"game_finished": True})
 
 
 def restart_game(session_id):
     """Resets game state to what it is before game has started."""
-    with shelve.open(get_shelve_file(session_id)) as db:
-        db["game_started"] = False
-        db["chosen_side"] = None
-        db["game_finished"] = False
-        db["board_stack"] = []
-        db["difficulty_selection"] = None
-        db["gave_initial_possible_actions"] = None
-
-
-def get_board_stack(session_id):
-    """Gets current board stack with board state before player's last move."""
-    with shelve.open(get_shelve_file(session_id)) as db:
-        if(db.get('board_stack') == None):
-            return []
-        else:
-            return db.get('board_stack')
-
-
-def set_board_stack(session_id, val):
-    """Sets current board stack, should be called every time BEFORE player makes VALID move."""
-    with shelve.open(get_shelve_file(session_id)) as db:
-        db["board_stack"] = val
+    _set_values(session_id, {
+        "game_started": False,
+        "chosen_side": None,
+        "game_finished": False,
+        "difficulty_selection": None,
+        "gave_initial_possible_actions": None,
+        "move_log_start": None,
+        "move_log_fen": None,
+        "move_count": 0,
+        "move_log": ""
+    })
+
+
+class SessionState:
+    """A request-scoped unit of work over a session's state.
+
+    Each key is read from the session cache the first time it is needed.
+    Writes during the request only touch this object. commit() applies every
+    change made since the last commit in a single write, and rollback()
+    discards them.
+
+    Attributes:
+        session_id (str): the unique session ID provided by the client.
+
+    """
+
+    def __init__(self, session_id):
+        self.session_id = session_id
+        self._changes = {}
+        # Load the session into the cache when the request starts
+        _load_session(session_id)
+
+    def _get(self, key, default=None):
+        if key in self._changes:
+            return self._changes[key]
+        return _get_value(self.session_id, key, default)
+
+    def _set(self, values):
+        self._changes.update(values)
+
+    def commit(self):
+        """Applies all pending changes to the session cache at once."""
+        if self._changes:
+            _set_values(self.session_id, self._changes)
+            self._changes = {}
+
+    def rollback(self):
+        """Discards all pending changes."""
+        self._changes = {}
+
+    def get_fulfillment_params(self):
+        """Get the fulfillment params."""
+        return self._get("fulfillment_params", {})
+
+    def set_fulfillment_params(self, params):
+        """Set the fulfillment params."""
+        self._set({"fulfillment_params": params})
+
+    def set_curr_log_id(self, log_id):
+        """Sets the current log_id for the session."""
+        self._set({"curr_log_id": log_id})
+
+    def get_game_state(self):
+        """Returns the game state dictionary, see get_game_state()."""
+        return {
+            "game_started": self._get("game_started"),
+            "chosen_side": self._get("chosen_side"),
+            "game_finished": self._get("game_finished"),
+            "difficulty_selection": self._get("difficulty_selection"),
+            "gave_initial_possible_actions": self._get("gave_initial_possible_actions"),
+            "move_count": self._get("move_count", 0)
+        }
+
+    def set_gave_initial_possible_actions(self):
+        """Sets gave_initial_possible_actions to True."""
+        self._set({"gave_initial_possible_actions": True})
+
+    def set_game_started(self):
+        """Sets game_started to True."""
+        self._set({"game_started": True})
+
+    def set_chosen_side(self, val):
+        """Sets chosen_side to a new value."""
+        self._set({"chosen_side": val})
+
+    def set_difficulty_selection(self, val):
+        """Sets difficulty_selection to a new value"""
+        self._set({"difficulty_selection": val})
+
+    def set_game_finished(self):
+        """Sets game_finished to True."""
+        self._set({"game_finished": True})
+
+    def restart_game(self):
+        """Resets game state to what it is before game has started."""
+        self._set({
+            "game_started": False,
+            "chosen_side": None,
+            "game_finished": False,
+            "difficulty_selection": None,
+            "gave_initial_possible_actions": None,
+            "move_log_start": None,
+            "move_log_fen": None,
+            "move_count": 0,
+            "move_log": ""
+        })
+
+    def record_move(self, board_str, move, by_user, updated_board_str):
+        """Appends a move to the move log.
+
+        If board_str is not the position the log ends at (for example, for a
+        new game), the log is restarted from board_str.
+
+        Args:
+            board_str (str): the FEN of the board before the move.
+            move (str): the move that was made, in UCI format.
+            by_user (bool): whether the user (rather than Andy) made the move.
+            updated_board_str (str): the FEN of the board after the move.
+
+        """
+        move_log = self._get("move_log", "")
+        move_count = self._get("move_count", 0)
+        if self._get("move_log_fen") != board_str:
+            move_log = ""
+            move_count = 0
+            self._set({"move_log_start": board_str})
+
+        player = "u" if by_user else "a"
+        self._set({
+            "move_log": f"{move_log}{player}:{move.lower()} ",
+            "move_count": move_count + 1,
+            "move_log_fen": updated_board_str
+        })
+
+    def undo_user_move(self):
+        """Removes the user's last move, and any moves after it, from the log.
+
+        Returns:
+            str | None: the FEN of the board before the user's last move, or
+                None if the user has not made a move.
+
+        """
+        # Find the user's last move
+        moves = self._get("move_log", "").split()
+        ply = len(moves) - 1
+        while ply >= 0 and not moves[ply].startswith("u:"):
+            ply -= 1
+        if ply < 0:
+            return None
+
+        # Rebuild the board up to that move
+        board = chess.Board(self._get("move_log_start"))
+        for move in moves[:ply]:
+            board.push_uci(move[2:])
+        updated_board_str = board.fen()
+
+        self._set({
+            "move_log": "".join(f"{move} " for move in moves[:ply]),
+            "move_count": ply,
+            "move_log_fen": updated_board_str
+        })
+        return updated_board_str
@@ -0,0 +1,104 @@
+"""Probes local Syzygy endgame tablebases before asking the engine.
+
+Tablebases are only used if SYZYGY_LOCATION is set. Positions with no more
+pieces than the largest loaded table are answered with the DTZ-optimal move,
+so they need no engine search.
+
+Attributes:
+    SYZYGY_LOCATION: a directory of Syzygy .rtbw and .rtbz files.
+
+"""
+import os
+import threading
+import traceback
+
+import chess
+import chess.syzygy
+
+SYZYGY_LOCATION = os.environ.get("SYZYGY_LOCATION")
+
+_tablebase = None
+_max_pieces = 0
+_tablebase_failed = False
+# Probes are serialized, since tables are opened and cached lazily
+_tablebase_lock = threading.Lock()
+_hits = 0
+_misses = 0
+
+
+def _count_pieces(filename):
+    """Returns the number of pieces in a table, from a name like KQvK.rtbw."""
+    return len(os.path.splitext(filename)[0].replace("v", ""))
+
+
+def _open_tablebase():
+    """Opens the tablebases on first use. Must hold _tablebase_lock."""
+    global _tablebase, _max_pieces, _tablebase_failed
+    if _tablebase is not None or _tablebase_failed:
+        return
+    try:
+        _tablebase = chess.syzygy.open_tablebase(SYZYGY_LOCATION)
+        _max_pieces = max(
+            (_count_pieces(name) for name in os.listdir(SYZYGY_LOCATION)
+             if name.endswith((".rtbw", ".rtbz"))),
+            default=0)
+    except Exception:
+        print(f"Failed to open tablebases: {traceback.format_exc()}")
+        _tablebase_failed = True
+
+
+def _move_score(board, move):
+    """Scores a move for the side to move, higher is better."""
+    board.push(move)
+    try:
+        if board.is_checkmate():
+            return (3, 0)
+        # DTZ is from the opponent's point of view after the move
+        dtz = _tablebase.probe_dtz(board)
+    finally:
+        board.pop()
+    if dtz < 0:
+        # A win, sooner is better
+        return (2, dtz)
+    elif dtz == 0:
+        return (1, 0)
+    else:
+        # A loss, later is better
+        return (0, dtz)
+
+
+def get_tablebase_move(board):
+    """Returns the DTZ-optimal move for a board as a UCI string.
+
+    Returns:
+        str: the move, or None if the position is not in the loaded tables.
+
+    """
+    global _hits, _misses
+    if not SYZYGY_LOCATION:
+        return None
+    with _tablebase_lock:
+        _open_tablebase()
+        if _tablebase is None or chess.popcount(board.occupied) > _max_pieces:
+            return None
+        try:
+            best_move = max(
+                board.legal_moves, key=lambda move: _move_score(board, move))
+        except (KeyError, ValueError):
+            # Missing tables, castling rights or no legal moves
+            _misses += 1
+            return None
+        _hits += 1
+        return best_move.uci()
+
+
+def get_tablebase_info():
+    """Returns the hit and miss counters for positions within the tables."""
+    with _tablebase_lock:
+        probes = _hits + _misses
+        return {
+            "hits": _hits,
+            "misses": _misses,
+            "hit_rate": _hits / probes if probes else 0.0,
+            "max_pieces": _max_pieces
+        }
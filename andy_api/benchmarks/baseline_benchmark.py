@@ -0,0 +1,167 @@
+"""Runs the state_manager benchmark workload against an older state_manager.
+
+This produces the "before" rows of RESULTS.md. It replays the same turns as
+state_manager_benchmark, calling the module-level functions of state_manager
+as it was before the session cache and state backends were added (commit
+9ccfddd). In that version every getter and setter opens the session's shelve
+file itself, each turn appends the FEN to a board stack, and there is no
+session lock or flush.
+
+Check out the old tree next to this one, then run from the andy_api
+directory:
+
+    git worktree add /tmp/andy-baseline 9ccfddd
+    python -m benchmarks.baseline_benchmark /tmp/andy-baseline
+    git worktree remove /tmp/andy-baseline
+
+"""
+import argparse
+import importlib.util
+import os
+import tempfile
+import time
+import uuid
+
+from benchmarks.state_manager_benchmark import (
+    generate_game,
+    percentile,
+    print_result
+)
+
+
+def load_state_manager(tree):
+    """Imports the state_manager module of another checkout by path."""
+    path = os.path.join(tree, "andy_api", "api", "state_manager.py")
+    spec = importlib.util.spec_from_file_location("baseline_state_manager", path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def get_response(sm, session_id, board_str, move, updated_board_str):
+    """State calls made by /get-response for a successful MOVE_PIECE."""
+    sm.get_game_state(session_id)
+    sm.set_curr_log_id(session_id, None)
+    sm.set_fulfillment_params(session_id, None)
+
+    # intent_processing.fulfill_intent and move_piece.handle
+    sm.get_game_state(session_id)
+    sm.set_fulfillment_params(session_id, params={
+        "from_location": move[0:2],
+        "to_location": move[2:4]
+    })
+    board_stack = sm.get_board_stack(session_id)
+    board_stack.append(board_str)
+    sm.set_board_stack(session_id, board_stack)
+    if not sm.get_game_state(session_id)["gave_initial_possible_actions"]:
+        sm.set_gave_initial_possible_actions(session_id)
+
+    # logging.log_user_request
+    sm.get_curr_errors(session_id)
+    sm.get_fulfillment_params(session_id)
+    sm.set_curr_log_id(session_id, uuid.uuid4().hex)
+
+    # Response body
+    sm.get_fulfillment_params(session_id)
+    sm.get_game_state(session_id)
+
+
+def get_audio_response(sm, session_id):
+    """State calls made by /get-audio-response."""
+    # logging.log_andy_response
+    sm.get_curr_errors(session_id)
+    sm.get_curr_log_id(session_id)
+
+
+def get_andy_move_response(sm, session_id, board_str, move, updated_board_str):
+    """State calls made by /get-andy-move-response."""
+    sm.get_game_state(session_id)
+
+    # logging.log_andy_move
+    sm.get_curr_errors(session_id)
+    sm.get_curr_log_id(session_id)
+
+    # Response body
+    sm.get_game_state(session_id)
+
+
+def start_session(sm, session_id):
+    sm.set_chosen_side(session_id, "white")
+    sm.set_difficulty_selection(session_id, "easy")
+    sm.set_game_started(session_id)
+
+
+def run_benchmark(sm, num_sessions, turns):
+    """Plays every session for a number of turns against a fresh directory.
+
+    Returns:
+        dict: ops/sec, latencies (ms) per route and bytes on disk, as
+            state_manager_benchmark.run_benchmark does.
+
+    """
+    latencies = {
+        "get-response": [],
+        "get-audio-response": [],
+        "get-andy-move-response": [],
+    }
+    game = generate_game(turns)
+
+    with tempfile.TemporaryDirectory() as directory:
+        sm.SHELVE_DIRECTORY = directory
+
+        session_ids = [str(uuid.uuid4()) for _ in range(num_sessions)]
+        for session_id in session_ids:
+            start_session(sm, session_id)
+
+        def timed(name, route):
+            start = time.perf_counter()
+            route()
+            latencies[name].append((time.perf_counter() - start) * 1000)
+
+        started_at = time.perf_counter()
+        for turn in range(turns):
+            user_ply = game[turn * 2]
+            andy_ply = game[turn * 2 + 1]
+            for session_id in session_ids:
+                timed("get-response",
+                      lambda: get_response(sm, session_id, *user_ply))
+                timed("get-audio-response",
+                      lambda: get_audio_response(sm, session_id))
+                timed("get-andy-move-response",
+                      lambda: get_andy_move_response(sm, session_id, *andy_ply))
+                timed("get-audio-response",
+                      lambda: get_audio_response(sm, session_id))
+        elapsed = time.perf_counter() - started_at
+
+        disk_usage = sum(
+            entry.stat().st_size for entry in os.scandir(directory))
+
+    ops = sum(len(values) for values in latencies.values())
+    return {
+        "ops_per_sec": ops / elapsed,
+        "latency_ms": {
+            name: (percentile(values, 50), percentile(values, 99))
+            for name, values in latencies.items()
+        },
+        "bytes_on_disk": disk_usage,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("tree", help="a checkout of the old tree")
+    parser.add_argument("--sessions", nargs="+", type=int,
+                        default=[1, 10, 1000])
+    parser.add_argument("--turns", nargs="+", type=int, default=[10, 40])
+    args = parser.parse_args()
+
+    sm = load_state_manager(args.tree)
+    print(f"{'backend':<8}{'sessions':>9}{'turns':>7}{'ops/sec':>12}{'disk bytes':>14}")
+    for num_sessions in args.sessions:
+        for turns in args.turns:
+            result = run_benchmark(sm, num_sessions, turns)
+            print_result("before", num_sessions, turns, result)
+
+
+if __name__ == "__main__":
+    main()
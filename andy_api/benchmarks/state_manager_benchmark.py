@@ -0,0 +1,213 @@
+"""Benchmarks state_manager under the workload of real game turns.
+
+Each turn replays the exact sequence of state_manager calls made by the routes
+for a successful move: get-response (MOVE_PIECE), get-audio-response,
+get-andy-move-response and get-audio-response again. Turns are interleaved
+across sessions, the way concurrent users would play. The write-behind thread
+runs as it does in the app, and the time to write the last changes at the
+end counts towards the run.
+
+Run from the andy_api directory:
+
+    python -m benchmarks.state_manager_benchmark
+    python -m benchmarks.state_manager_benchmark --sessions 1 10 --turns 10 40 --backends sqlite
+
+"""
+import argparse
+import os
+import random
+import statistics
+import tempfile
+import time
+import uuid
+
+# The api package needs these to be importable outside of a running app
+os.environ.setdefault("STOCKFISH_LOCATION", "stockfish")
+os.environ.setdefault("LOGGING_SUFFIX", "benchmark")
+
+import chess  # noqa: E402
+
+from api import state_manager  # noqa: E402
+from api.state_backends import ShelveBackend, SQLiteBackend  # noqa: E402
+from api.state_manager import SessionState  # noqa: E402
+
+BACKENDS = {
+    "shelve": lambda directory: ShelveBackend(f"{directory}/shelve"),
+    "sqlite": lambda directory: SQLiteBackend(f"{directory}/state.db"),
+}
+
+
+def run_route(session_id, route):
+    """Runs a route while holding the session lock, as the blueprint does."""
+    lock = state_manager.session_lock(session_id)
+    lock.acquire()
+    try:
+        route()
+    finally:
+        lock.release()
+
+
+def get_response(session_id, board_str, move, updated_board_str):
+    """State calls made by /get-response for a successful MOVE_PIECE."""
+    session_state = SessionState(session_id)
+    session_state.get_game_state()
+    session_state.set_curr_log_id(None)
+    session_state.set_fulfillment_params(None)
+    session_state.commit()
+
+    # intent_processing.fulfill_intent and move_piece.handle
+    session_state.get_game_state()
+    session_state.set_fulfillment_params(params={
+        "from_location": move[0:2],
+        "to_location": move[2:4]
+    })
+    session_state.record_move(board_str, move, True, updated_board_str)
+    if not session_state.get_game_state()["gave_initial_possible_actions"]:
+        session_state.set_gave_initial_possible_actions()
+    session_state.commit()
+
+    # logging.log_user_request
+    state_manager.get_curr_errors(session_id)
+    state_manager.get_fulfillment_params(session_id)
+    state_manager.set_curr_log_id(session_id, uuid.uuid4().hex)
+
+    # Response body
+    session_state.get_fulfillment_params()
+    session_state.get_game_state()
+
+
+def get_audio_response(session_id):
+    """State calls made by /get-audio-response."""
+    # logging.log_andy_response
+    state_manager.get_curr_errors(session_id)
+    state_manager.get_curr_log_id(session_id)
+
+
+def get_andy_move_response(session_id, board_str, move, updated_board_str):
+    """State calls made by /get-andy-move-response."""
+    session_state = SessionState(session_id)
+    session_state.get_game_state()
+    session_state.record_move(board_str, move, False, updated_board_str)
+    session_state.commit()
+
+    # logging.log_andy_move
+    state_manager.get_curr_errors(session_id)
+    state_manager.get_curr_log_id(session_id)
+
+    # Response body
+    session_state.get_game_state()
+
+
+def generate_game(turns):
+    """Returns a list of (board_str, move, updated_board_str) plies."""
+    plies = []
+    while len(plies) < turns * 2:
+        board = chess.Board()
+        plies = []
+        while len(plies) < turns * 2 and not board.is_game_over():
+            board_str = board.fen()
+            move = random.choice(list(board.legal_moves)).uci()
+            board.push_uci(move)
+            plies.append((board_str, move, board.fen()))
+    return plies
+
+
+def start_session(session_id):
+    session_state = SessionState(session_id)
+    session_state.set_chosen_side("white")
+    session_state.set_difficulty_selection("easy")
+    session_state.set_game_started()
+    session_state.commit()
+
+
+def run_benchmark(backend_name, num_sessions, turns):
+    """Plays every session for a number of turns against a fresh store.
+
+    Returns:
+        dict: ops/sec, latencies (ms) per route and bytes on disk.
+
+    """
+    latencies = {
+        "get-response": [],
+        "get-audio-response": [],
+        "get-andy-move-response": [],
+    }
+    game = generate_game(turns)
+
+    with tempfile.TemporaryDirectory() as directory:
+        backend = BACKENDS[backend_name](directory)
+        if backend_name == "shelve":
+            os.makedirs(backend.directory)
+        state_manager.set_backend(backend)
+
+        session_ids = [str(uuid.uuid4()) for _ in range(num_sessions)]
+        for session_id in session_ids:
+            run_route(session_id, lambda: start_session(session_id))
+
+        def timed(name, session_id, route):
+            start = time.perf_counter()
+            run_route(session_id, route)
+            latencies[name].append((time.perf_counter() - start) * 1000)
+
+        started_at = time.perf_counter()
+        for turn in range(turns):
+            user_ply = game[turn * 2]
+            andy_ply = game[turn * 2 + 1]
+            for session_id in session_ids:
+                timed("get-response", session_id,
+                      lambda: get_response(session_id, *user_ply))
+                timed("get-audio-response", session_id,
+                      lambda: get_audio_response(session_id))
+                timed("get-andy-move-response", session_id,
+                      lambda: get_andy_move_response(session_id, *andy_ply))
+                timed("get-audio-response", session_id,
+                      lambda: get_audio_response(session_id))
+        state_manager.flush_all_sessions()
+        elapsed = time.perf_counter() - started_at
+
+        disk_usage = backend.disk_usage()
+
+    ops = sum(len(values) for values in latencies.values())
+    return {
+        "ops_per_sec": ops / elapsed,
+        "latency_ms": {
+            name: (percentile(values, 50), percentile(values, 99))
+            for name, values in latencies.items()
+        },
+        "bytes_on_disk": disk_usage,
+    }
+
+
+def percentile(values, pct):
+    if len(values) < 2:
+        return values[0] if values else 0
+    return statistics.quantiles(values, n=100, method="inclusive")[pct - 1]
+
+
+def print_result(backend_name, num_sessions, turns, result):
+    print(f"{backend_name:<8}{num_sessions:>9}{turns:>7}"
+          f"{result['ops_per_sec']:>12.1f}{result['bytes_on_disk']:>14}")
+    for name, (p50, p99) in result["latency_ms"].items():
+        print(f"{'':<8}  {name:<24} p50 {p50:8.3f} ms   p99 {p99:8.3f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--backends", nargs="+",
+                        default=list(BACKENDS), choices=list(BACKENDS))
+    parser.add_argument("--sessions", nargs="+", type=int,
+                        default=[1, 10, 1000])
+    parser.add_argument("--turns", nargs="+", type=int, default=[10, 40])
+    args = parser.parse_args()
+
+    state_manager.start_write_behind()
+    print(f"{'backend':<8}{'sessions':>9}{'turns':>7}{'ops/sec':>12}{'disk bytes':>14}")
+    for backend_name in args.backends:
+        for num_sessions in args.sessions:
+            for turns in args.turns:
+                result = run_benchmark(backend_name, num_sessions, turns)
+                print_result(backend_name, num_sessions, turns, result)
+
+
+if __name__ == "__main__":
+    main()
@@ -12,9 +12,9 @@ export GOOGLE_APPLICATION_CREDENTIALS=$KEY_PATH
 # Set the stockfish location
 export STOCKFISH_LOCATION=$STOCKFISH_LOCATION
 
-# Set flask environment variables
-export FLASK_APP=api
-export FLASK_ENV=development
+# Set quart environment variables
+export QUART_APP=api
+export QUART_ENV=development
 
 # Set the app mode
 export STARTING_BOARD=$STARTING_BOARD
@@ -23,4 +23,4 @@ export STARTING_BOARD=$STARTING_BOARD
 export LOGGING_SUFFIX=$LOG_SUFFIX
 
 # Run the app
-exec python -m flask run
+exec python -m quart run
@@ -2,7 +2,13 @@
 
 Based on https://github.com/wiseman/py-webrtcvad/blob/master/example.py.
 """
+import io
+import json
+import struct
+import time
 import uuid
+import wave
+import pygame
 import requests
 import speech_recognition as sr
 import simpleaudio as sa
@@ -18,8 +24,12 @@ from .help_timer_counter import HelpTimerCounter
 
 BASE_API_URL = "http://127.0.0.1:5000/api"
 SESSION_ID = str(uuid.uuid4())
-USER_AUDIO_FILENAME = f"{AUDIO_PATH}/user_audio.wav"
-ANDY_AUDIO_FILENAME = f"{AUDIO_PATH}/andy_audio.wav"
+# The user's audio is uploaded as 16 kHz FLAC
+USER_AUDIO_SAMPLE_RATE = 16000
+USER_AUDIO_FILENAME = f"{AUDIO_PATH}/user_audio.flac"
+USER_AUDIO_TYPE = "audio/flac"
+# Andy's audio is downloaded as MP3, one of "wav", "mp3" or "ogg_opus"
+ANDY_AUDIO_FORMAT = "mp3"
 
 # Speech recognition constants
 STARTING_ENERGY_THRESHOLD = 3000
@@ -52,8 +62,7 @@ def run():
             if game_engine.isGameStarted and timer_counter.check_timer():
                 print("TRIGGER")
                 timer_counter.stop_timer()
-                audio_response = get_help_response("TIMEOUT")
-                play_audio_response(audio_response)
+                play_help_response("TIMEOUT")
                 continue
             else:
                 # Go back to the start of the loop
@@ -61,14 +70,16 @@ def run():
 
         # Generate an audio file
         with open(USER_AUDIO_FILENAME, "wb") as f:
-            f.write(audio.get_wav_data())
+            f.write(audio.get_flac_data(
+                convert_rate=USER_AUDIO_SAMPLE_RATE, convert_width=2))
 
-        # Get the intent
-        intent_response = get_user_intent(
+        # Take the turn
+        turn_response = take_turn(
             detected_text, start_recording_at, stop_recording_at)
         # If no intent was detected, go back to the start of the loop
-        if not intent_response:
+        if not turn_response:
             continue
+        intent_response, turn_stream = turn_response
         print(intent_response["fulfillment_info"]["intent_name"])
 
         response_game_state = intent_response["game_state"]
@@ -78,21 +89,16 @@ def run():
         # Successful or failed fulfillments
         if game_engine.isGameStarted and response_intent_name == "FALLBACK" and timer_counter.update_counter():
             timer_counter.hit_counter()
-            # Get the audio response
-            audio_response = get_help_response("FALLBACK")
-            # Play the audio response
-            play_audio_response(audio_response)
+            # Play the help response instead of the turn's response
+            turn_stream.close()
+            play_help_response("FALLBACK")
             timer_counter.update_timer()
         else:
             if response_intent_name != "FALLBACK":
                 timer_counter.reset_counter()
             timer_counter.update_timer()
-            # Get Andy's audio response
-            audio_response = get_audio_response(
-                intent_response["response_text"])
-
-            # Play the audio response
-            play_audio_response(audio_response)
+            # Play Andy's audio response as it arrives
+            play_audio_stream(turn_stream.raw)
 
             # Successful fulfillments only
             if fulfillment_success:
@@ -102,10 +108,10 @@ def run():
                     to_loc = intent_response['fulfillment_params']['to_location']
                     update_move_history(True, from_loc, to_loc)
                     # Move Andy's piece
-                    handle_move_andy_piece()
+                    handle_move_andy_piece(turn_stream.raw)
                 elif response_intent_name == "SELECT_DIFFICULTY" and game_engine.user_is_black:
                     # Make Andy's first move
-                    handle_move_andy_piece()
+                    handle_move_andy_piece(turn_stream.raw)
                 elif response_intent_name == "RESTART_GAME_YES":
                     # Clear all of the game state
                     game_engine.move_history.clear()
@@ -115,6 +121,7 @@ def run():
                     game_engine.is_game_over = False
                     game_engine.board = None
                     timer_counter = HelpTimerCounter()
+                    turn_stream.close()
                     continue
                 elif response_intent_name == "UNDO_MOVE":
                     if len(game_engine.move_history) > 1:
@@ -125,23 +132,65 @@ def run():
                 # Enable the counter when we encounter a successful intent
                 timer_counter.start_timer()
 
+        turn_stream.close()
+
         # Update game state
         game_engine.is_game_over = response_game_state["game_finished"]
         if game_engine.is_game_over:
             timer_counter.stop_timer()
 
 
-def play_audio_response(audio_data: bytes):
+def read_part(stream) -> bytes:
+    """
+    Reads one part of a streamed response, which is preceded by its length as
+    a 4-byte big-endian integer.
+    """
+    length = struct.unpack(">I", stream.read(4))[0]
+    return stream.read(length)
+
+
+class CompressedPlayObject:
     """
-    Plays Andy's audio response from raw bytes.
+    Waits on a clip played with pygame's music player, like the PlayObject
+    simpleaudio returns for WAV clips.
     """
-    f = open(ANDY_AUDIO_FILENAME, "wb")
-    f.truncate(0)
-    f.write(audio_data)
-    f.close()
-    wave_obj = sa.WaveObject.from_wave_file(ANDY_AUDIO_FILENAME)
-    play_obj = wave_obj.play()
-    play_obj.wait_done()  # Wait until sound has finished playing
+
+    def wait_done(self):
+        while pygame.mixer.music.get_busy():
+            time.sleep(0.01)
+
+
+def play_audio_clip(clip: bytes):
+    """
+    Starts playing one audio clip, decoding it by its format. WAV clips (such
+    as the API's TTS error audio) are played with simpleaudio, while MP3 and
+    Ogg Opus clips are decoded by pygame.
+    """
+    if clip.startswith(b"RIFF"):
+        wave_obj = sa.WaveObject.from_wave_read(wave.open(io.BytesIO(clip)))
+        return wave_obj.play()
+    if not pygame.mixer.get_init():
+        pygame.mixer.init()
+    namehint = "ogg" if clip.startswith(b"OggS") else "mp3"
+    pygame.mixer.music.load(io.BytesIO(clip), namehint)
+    pygame.mixer.music.play()
+    return CompressedPlayObject()
+
+
+def play_audio_stream(stream):
+    """
+    Plays Andy's streamed audio response, starting on the first sentence.
+    Each sentence is an audio clip, and an empty part ends the stream.
+    """
+    play_obj = None
+    while True:
+        # Read the next sentence while the previous one plays
+        clip = read_part(stream)
+        if play_obj:
+            play_obj.wait_done()
+        if not clip:
+            break
+        play_obj = play_audio_clip(clip)
 
 
 def record_audio(r: sr.Recognizer) -> Tuple[sr.AudioData, datetime, datetime]:
@@ -196,16 +245,13 @@ def recognize_audio(r: sr.Recognizer, audio: sr.AudioData) -> Union[str, None]:
         return None
 
 
-def handle_move_andy_piece():
+def handle_move_andy_piece(stream):
     # Get Andy's move
-    andy_move_response = get_andy_move()
+    andy_move_response = json.loads(read_part(stream))
     if not andy_move_response:
         return
-    # Get the audio response
-    audio_response = get_audio_response(
-        andy_move_response["response_text"])
     # Play the audio response
-    play_audio_response(audio_response)
+    play_audio_stream(stream)
     # Update game state
     game_engine.board = chess.Board(
         andy_move_response["board_str"])
@@ -224,50 +270,25 @@ def update_move_history(user_move: bool, from_location: str, to_location: str):
     game_engine.move_history.insert(0, entry)
 
 
-def get_help_response(help_type):
+def play_help_response(help_type):
     """
     help_type is one of ["TIMEOUT", "FALLBACK"]
     """
-    request_url = f"{BASE_API_URL}/get-help-audio-response?session_id={SESSION_ID}&help_type={help_type}"
-    response = requests.get(request_url)
-    if response.status_code == 200:
-        return response.content
-    else:
-        print("API Error, Status Code:" + str(response.status_code))
-        raise Exception
-
-
-def get_audio_response(text):
-    request_url = f"{BASE_API_URL}/get-audio-response?session_id={SESSION_ID}"
-    print(f"Body: {text}")
-    response = requests.post(request_url, text)
-    if response.status_code == 200:
-        return response.content
-    else:
-        print("API Error, Status Code:" + str(response.status_code))
-        raise Exception
-
-
-def get_andy_move():
-    try:
-        request_url = f"{BASE_API_URL}/get-andy-move-response?session_id={SESSION_ID}&board_str={game_engine.board.fen()}"
-        response = requests.get(request_url)
+    request_url = f"{BASE_API_URL}/get-help-audio-response?session_id={SESSION_ID}&help_type={help_type}&stream=true&audio_format={ANDY_AUDIO_FORMAT}"
+    with requests.get(request_url, stream=True) as response:
         if response.status_code == 200:
-            return response.json()
+            play_audio_stream(response.raw)
         else:
             print("API Error, Status Code:" + str(response.status_code))
-            return None
-    except Exception as e:
-        print(e)
-        return None
+            raise Exception
 
 
-def get_user_intent(detected_text, start_recording, stop_recording):
+def take_turn(detected_text, start_recording, stop_recording):
     try:
         recording_time_ms = (
             stop_recording - start_recording).total_seconds() * 1000
 
-        request_url = f"{BASE_API_URL}/get-response?session_id={SESSION_ID}&detected_text={detected_text}"
+        request_url = f"{BASE_API_URL}/turn?session_id={SESSION_ID}&detected_text={detected_text}&stream=true&audio_format={ANDY_AUDIO_FORMAT}"
 
         # Add board string to request URL
         if game_engine.board:
@@ -278,10 +299,12 @@ def get_user_intent(detected_text, start_recording, stop_recording):
 
         # Make the request
         response = requests.post(request_url, open(
-            USER_AUDIO_FILENAME, 'rb'), USER_AUDIO_FILENAME)
+            USER_AUDIO_FILENAME, 'rb'), USER_AUDIO_FILENAME, stream=True,
+            headers={"Content-Type": USER_AUDIO_TYPE})
 
         if response.status_code == 200:
-            response_json = response.json()
+            # The rest of the turn is played as it arrives
+            response_json = json.loads(read_part(response.raw))
 
             if response_json["game_state"]["chosen_side"] == "black":
                 game_engine.user_is_black = True
@@ -290,7 +313,7 @@ def get_user_intent(detected_text, start_recording, stop_recording):
                 game_engine.board = chess.Board(response_json["board_str"])
                 game_engine.isGameStarted = True
 
-            return response_json
+            return response_json, response
         else:
             print("API Error, Status Code:" + str(response.status_code))
             return None